@@ -0,0 +1,246 @@
+#  Bulk.py -- Parallel offline decoding of capture files
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import argparse
+import itertools
+import json
+import mmap
+import multiprocessing
+import sys
+
+import Capture
+import Clock
+import ESP
+
+'''
+Usage :
+    python Bulk.py capture.eocp [ -o packets.jsonl ] [ -j processes ]
+
+Decodes the received data of a capture file ( see Capture.py ) to one JSON
+object per line and packet, in capture order.
+
+The received stream is cut into segments of about SEGMENT_SIZE bytes. Each cut
+is placed on a verified packet start: a SYNC byte with valid CRC8H and CRC8D,
+followed by the end of data or another valid header. A segment therefore
+always starts in sync and never ends inside a packet, so segments are decoded
+independently in a process pool and their output simply concatenated.
+'''
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+
+'''
+Largest possible ESP3 packet, the window searched for a cut must hold one
+'''
+MAX_PACKET = 7 + 0xFFFF + 0xFF
+
+'''
+Function    : _verifiedSync
+Description : Finds the first verified packet start in a window of received data
+Arguments   : window - raw data as bytearray
+              final  - True if window reaches the end of received data
+Returns     : position in window, -1 if none
+'''
+def _verifiedSync( window, final ):
+    end = len( window )
+    pos = window.find( '\x55' )
+    while 0 <= pos and pos + 6 <= end:
+        if ESP.calcCRC8Header( window, pos ) == window[pos+5]:
+            nextPos = pos + 7 + window[pos+1]*256 + window[pos+2] + window[pos+3]
+            if nextPos <= end and ESP.calcCRC8( window[pos+6:nextPos-1] ) == window[nextPos-1]:
+                if nextPos == end and final:
+                    return pos
+                if nextPos + 6 <= end and window[nextPos] == 0x55 and \
+                   ESP.calcCRC8Header( window, nextPos ) == window[nextPos+5]:
+                    return pos
+        pos = window.find( '\x55', pos + 1 )
+    return -1
+
+'''
+Function    : _findCut
+Description : Finds where a segment may start, at or after a received record
+Arguments   : data    - capture file contents
+              records - received records as ( file position, length, time )
+              index   - index in records to start searching from
+Returns     : ( record index, bytes to skip in that record ), None if none found
+'''
+def _findCut( data, records, index ):
+    window = bytearray()
+    starts = []
+    last = index
+    while last < len( records ) and len( window ) < 2 * MAX_PACKET:
+        pos, length, seconds = records[last]
+        starts.append( len( window ) )
+        window.extend( data[pos:pos+length] )
+        last = last + 1
+    sync = _verifiedSync( window, last == len( records ) )
+    if sync < 0:
+        return None
+    for i in range( len( starts ) - 1, -1, -1 ):
+        if starts[i] <= sync:
+            return ( index + i, sync - starts[i] )
+
+'''
+Function    : planSegments
+Description : Cuts the received data of a capture into segments starting on
+              verified packet starts
+Arguments   : replay      - Capture.Replay of the capture file
+              segmentSize - approximate number of received bytes per segment
+Returns     : list of segments, each a list of ( file position, length, time )
+              of the received data it covers
+'''
+def planSegments( replay, segmentSize = SEGMENT_SIZE ):
+    records = [ ( pos, length, seconds )
+                for seconds, direction, pos, length in replay.offsets()
+                if direction == Capture.RX and length ]
+    cuts = [ ( 0, 0 ) ]
+    size = 0
+    index = 0
+    while index < len( records ):
+        if size >= segmentSize:
+            cut = _findCut( replay.map, records, index )
+            if cut is None:
+                break
+            if cut > cuts[-1]:
+                cuts.append( cut )
+                size = 0
+                index = cut[0]
+        size = size + records[index][1]
+        index = index + 1
+    cuts.append( ( len( records ), 0 ) )
+
+    segments = []
+    for ( first, skip ), ( last, keep ) in zip( cuts, cuts[1:] ):
+        segment = records[first:last+1 if keep else last]
+        if skip:
+            pos, length, seconds = segment[0]
+            segment[0] = ( pos + skip, length - skip, seconds )
+        if keep:
+            pos, length, seconds = segment[-1]
+            segment[-1] = ( pos, keep if len( segment ) > 1 else keep - skip, seconds )
+        segments.append( segment )
+    return segments
+
+'''
+Function    : formatPacket
+Description : Converts a packet to one line of JSON
+Arguments   : seconds - unix time the packet was received
+              pkt     - packet as returned by ESP.decodePacket
+Returns     : line of text ending with newline
+'''
+def formatPacket( seconds, pkt ):
+    line = { 'time'     : round( seconds, 6 ),
+             'type'     : pkt.pktType,
+             'data'     : pkt.data.tobytes().encode( 'hex' ),
+             'optData'  : pkt.optData.tobytes().encode( 'hex' ) }
+    # the framer hands out only packets with a valid CRC8D
+    if pkt.pktType == ESP.ESP_packetTypes['RADIO']:
+        telegram = ESP.decodeRadioData( pkt )
+        line['dev'] = telegram['dev']
+        # short telegrams have no sender, unknown profiles no values
+        if 'sender' in telegram:
+            line['sender'] = "%08X" %( telegram['sender'] )
+        if 'values' in telegram:
+            line['eep'] = telegram['eep']
+            line['values'] = telegram['values']
+    return json.dumps( line, sort_keys = True ) + '\n'
+
+'''
+Function    : decodeSegment
+Description : Decodes one segment, run in a worker process
+Arguments   : job - ( capture file name, capture start time, segment )
+Returns     : ( decoded packets as lines of JSON, number of packets,
+                number of packets dropped for a bad CRC8D )
+'''
+def decodeSegment( job ):
+    path, started, segment = job
+    with open( path, 'rb' ) as captureFile:
+        data = mmap.mmap( captureFile.fileno(), 0, access = mmap.ACCESS_READ )
+        framer = ESP.Framer()
+        lines = []
+        for pos, length, seconds in segment:
+            for frame in framer.feed( data[pos:pos+length] ):
+                lines.append( formatPacket( started + seconds, ESP.decodePacket( frame ) ) )
+        # the next segment starts on a verified packet, what is still pending
+        # is a false SYNC byte announcing a long packet: rescan behind it
+        while framer.pending():
+            for frame in framer.resync():
+                lines.append( formatPacket( started + seconds, ESP.decodePacket( frame ) ) )
+        data.close()
+    return ''.join( lines ), len( lines ), framer.crc8dErrors
+
+'''
+Function    : decodeCapture
+Description : Decodes a whole capture file in parallel, writing packets in
+              capture order
+Arguments   : path        - capture file name
+              output      - file object to write lines of JSON to
+              processes   - number of worker processes, number of CPUs if
+                            None, 1 decodes in this process
+              segmentSize - approximate number of received bytes per segment
+Returns     : ( number of packets decoded, number of packets dropped for a
+                bad CRC8D )
+'''
+def decodeCapture( path, output, processes = None, segmentSize = SEGMENT_SIZE ):
+    replay = Capture.Replay( path )
+    segments = planSegments( replay, segmentSize )
+    jobs = [ ( path, replay.started, segment ) for segment in segments ]
+    replay.close()
+    pool = None
+    if processes == 1:
+        results = itertools.imap( decodeSegment, jobs )
+    else:
+        pool = multiprocessing.Pool( processes )
+        results = pool.imap( decodeSegment, jobs )
+    nPackets = 0
+    nErrors = 0
+    try:
+        for text, count, errors in results:
+            output.write( text )
+            nPackets = nPackets + count
+            nErrors = nErrors + errors
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return nPackets, nErrors
+
+'''
+Function    : main
+Description : main function
+Arguments   : see Usage
+Returns     : none
+'''
+def main():
+    parser = argparse.ArgumentParser( description = 'Parallel capture file decoder' )
+    parser.add_argument( 'capture' )
+    parser.add_argument( '-o', '--output' )
+    parser.add_argument( '-j', '--processes', type = int )
+    parser.add_argument( '--segment-size', type = int, default = SEGMENT_SIZE )
+    options = parser.parse_args()
+
+    output = open( options.output, 'w' ) if options.output else sys.stdout
+    started = Clock.monotonic()
+    nPackets, nErrors = decodeCapture( options.capture, output, options.processes, options.segment_size )
+    elapsed = Clock.monotonic() - started
+    if options.output:
+        output.close()
+    print >> sys.stderr, "Decoded %d packets ( %d CRC8D errors ) in %.3f s" %( nPackets, nErrors, elapsed )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#  Capture.py -- Recording and replay of raw gateway traffic
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import mmap
+import struct
+import sys
+import threading
+import time
+
+import Clock
+import ESP
+
+'''
+Capture file structure ( little endian ):
+
+File header, 16 bytes:
++--------+---------+-----------+-------------------------+
+| 'EOCP' | version |  3 x pad  | start, unix time double |
++--------+---------+-----------+-------------------------+
+
+followed by records, each a chunk of raw data as read from or written to the
+port:
+       8                    2             1          length
++--------------------+-------------+-----------+-------------/-----------+
+| time, microseconds |   length    | direction |         raw data        |
++--------------------+-------------+-----------+-------------/-----------+
+
+time is taken from a monotonic clock and counts from the start of capture.
+'''
+MAGIC       = 'EOCP'
+VERSION     = 1
+
+RX          = 0     # data received from gateway
+TX          = 1     # data sent to gateway
+
+_fileHeader = struct.Struct( '<4sB3xd' )
+_recordHeader = struct.Struct( '<QHB' )
+
+MAX_CHUNK   = 0xFFFF
+
+'''
+Class       : CaptureWriter
+Description : Appends raw data chunks with timestamps to a capture file.
+              Safe to use from several threads.
+'''
+class CaptureWriter( object ):
+
+    def __init__( self, path ):
+        self.file = open( path, 'wb' )
+        self.start = Clock.monotonic()
+        self.lock = threading.Lock()
+        self.file.write( _fileHeader.pack( MAGIC, VERSION, time.time() ) )
+
+    '''
+    Function    : CaptureWriter.write
+    Description : Records a chunk of raw data
+    Arguments   : data      - raw data ( bytearray, str or list of numbers )
+                  direction - RX or TX
+    Returns     : none
+    '''
+    def write( self, data, direction = RX ):
+        micros = int( ( Clock.monotonic() - self.start ) * 1000000 )
+        data = bytes( bytearray( data ) )
+        with self.lock:
+            for pos in range( 0, len( data ), MAX_CHUNK ):
+                chunk = data[pos:pos+MAX_CHUNK]
+                self.file.write( _recordHeader.pack( micros, len( chunk ), direction ) )
+                self.file.write( chunk )
+
+    '''
+    Function    : CaptureWriter.close
+    Description : Flushes and closes the capture file
+    Arguments   : none
+    Returns     : none
+    '''
+    def close( self ):
+        with self.lock:
+            self.file.close()
+
+'''
+Class       : Replay
+Description : Reads a capture file through mmap, so that even large captures
+              are replayed without loading them into memory
+'''
+class Replay( object ):
+
+    def __init__( self, path ):
+        self.file = open( path, 'rb' )
+        self.map = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ )
+        magic, version, self.started = _fileHeader.unpack_from( self.map, 0 )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError( '%s is not a capture file' %( path ) )
+
+    '''
+    Function    : Replay.offsets
+    Description : Iterates over the records of the capture without reading
+                  their data. A record cut short at the end of file ( eg.
+                  capture killed ) is ignored.
+    Arguments   : none
+    Returns     : generator of ( time in seconds, direction, position of raw
+                  data in file, length of raw data )
+    '''
+    def offsets( self ):
+        data = self.map
+        pos = _fileHeader.size
+        end = len( data )
+        headerSize = _recordHeader.size
+        while pos + headerSize <= end:
+            micros, length, direction = _recordHeader.unpack_from( data, pos )
+            pos = pos + headerSize
+            if pos + length > end:
+                return
+            yield ( micros / 1000000.0, direction, pos, length )
+            pos = pos + length
+
+    '''
+    Function    : Replay.records
+    Description : Iterates over the records of the capture
+    Arguments   : none
+    Returns     : generator of ( time in seconds, direction, raw data as str )
+    '''
+    def records( self ):
+        data = self.map
+        for seconds, direction, pos, length in self.offsets():
+            yield ( seconds, direction, data[pos:pos+length] )
+
+    '''
+    Function    : Replay.chunks
+    Description : Iterates over the received data chunks, either as fast as
+                  possible or paced like they were captured
+    Arguments   : realtime - wait between chunks as in the capture
+                  speed    - replay speed factor when realtime
+    Returns     : generator of raw data chunks as str
+    '''
+    def chunks( self, realtime = False, speed = 1.0 ):
+        start = None
+        for offset, direction, chunk in self.records():
+            if direction != RX:
+                continue
+            if realtime:
+                if start is None:
+                    start = Clock.monotonic() - offset / speed
+                delay = start + offset / speed - Clock.monotonic()
+                if delay > 0:
+                    time.sleep( delay )
+            yield chunk
+
+    '''
+    Function    : Replay.packets
+    Description : Replays the received data through ESP.Framer and
+                  ESP.decodePacket, as the gateway loop would
+    Arguments   : realtime, speed - as for Replay.chunks
+                  framer          - ESP.Framer to use, eg. to read its
+                                    counters afterwards
+    Returns     : generator of Packet
+    '''
+    def packets( self, realtime = False, speed = 1.0, framer = None ):
+        framer = framer or ESP.Framer()
+        for chunk in self.chunks( realtime, speed ):
+            for frame in framer.feed( chunk ):
+                yield ESP.decodePacket( frame )
+        # end of capture, give up what is left of a packet announced too long
+        while framer.pending():
+            for frame in framer.resync():
+                yield ESP.decodePacket( frame )
+
+    '''
+    Function    : Replay.close
+    Description : Releases the capture file
+    Arguments   : none
+    Returns     : none
+    '''
+    def close( self ):
+        self.map.close()
+        self.file.close()
+
+'''
+Function    : main
+Description : Replays a capture as fast as possible and reports decoder
+              throughput
+Arguments   : capture file name on command line
+Returns     : none
+'''
+def main():
+    if len( sys.argv ) < 2:
+        print "Usage : Capture.py <capture file>"
+        return
+    replay = Replay( sys.argv[1] )
+    nBytes = 0
+    for offset, direction, chunk in replay.records():
+        if direction == RX:
+            nBytes = nBytes + len( chunk )
+    nPackets = 0
+    framer = ESP.Framer()
+    started = Clock.monotonic()
+    for pkt in replay.packets( framer = framer ):
+        nPackets = nPackets + 1
+    # packets with a bad CRC8D never leave the framer
+    nErrors = framer.crc8dErrors
+    elapsed = Clock.monotonic() - started
+    replay.close()
+    print "Replayed %d bytes, %d packets ( %d CRC8D errors ) in %.3f s" %( nBytes, nPackets, nErrors, elapsed )
+    if elapsed > 0:
+        print "Throughput : %.0f packets/s, %.0f bytes/s" %( nPackets / elapsed, nBytes / elapsed )
+
+if __name__ == "__main__":
+    main()
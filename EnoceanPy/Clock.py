@@ -0,0 +1,50 @@
+#  Clock.py -- Monotonic time source
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import ctypes
+import ctypes.util
+import time
+
+class _timespec( ctypes.Structure ):
+    _fields_ = [ ( 'tv_sec', ctypes.c_long ), ( 'tv_nsec', ctypes.c_long ) ]
+
+CLOCK_MONOTONIC = 1
+
+def _clockGettime():
+    try:
+        librt = ctypes.CDLL( ctypes.util.find_library( 'rt' ) or 'librt.so.1' )
+        clock_gettime = librt.clock_gettime
+    except ( OSError, AttributeError ):
+        return None
+    clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER( _timespec ) ]
+    def monotonic():
+        spec = _timespec()
+        clock_gettime( CLOCK_MONOTONIC, ctypes.byref( spec ) )
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return monotonic
+
+'''
+Function    : monotonic
+Description : Seconds from an arbitrary start, never going backwards when the
+              system clock is set. Uses clock_gettime( CLOCK_MONOTONIC ) where
+              available, time.time() otherwise.
+Arguments   : none
+Returns     : time in seconds as float
+'''
+monotonic = getattr( time, 'monotonic', None ) or _clockGettime() or time.time
@@ -0,0 +1,88 @@
+#  Dedup.py -- Suppression of telegrams repeated by EnOcean repeaters
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import time
+from collections import deque
+
+'''
+A repeater sends a received telegram again with the repeater count ( bits 0-3
+of the status byte ) incremented. The copies are recognised by the telegram
+data up to and including the sender ID, together with the rest of the status
+byte. Optional data ( dBm, subtelegram count ) differs between copies and is
+not compared.
+'''
+REPEATER_COUNT_MASK = 0x0F
+
+'''
+Class       : DedupCache
+Description : Remembers recently seen RADIO telegrams for ttl seconds, and
+              tells whether a telegram is a copy of one of them
+'''
+class DedupCache( object ):
+
+    def __init__( self, ttl = 0.5, capacity = 1024 ):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.seen = {}              # key -> time first seen
+        self.order = deque()        # ( time, key ), oldest first
+        self.passed = 0             # telegrams let through
+        self.suppressed = 0         # duplicates found
+
+    '''
+    Function    : DedupCache.isDuplicate
+    Description : Checks a packet against the recently seen telegrams and
+                  remembers it if new. Packets other than RADIO are never
+                  duplicates.
+    Arguments   : frame - raw packet as returned by ESP.Framer
+                  now   - current time, time.time() if not given
+    Returns     : True if the telegram was already seen within ttl
+    '''
+    def isDuplicate( self, frame, now = None ):
+        if frame[4] != 0x01:        # RADIO
+            return False
+        if now is None:
+            now = time.time()
+        # forget telegrams older than ttl
+        seen = self.seen
+        order = self.order
+        expired = now - self.ttl
+        while order and order[0][0] <= expired:
+            del seen[order.popleft()[1]]
+        statusPos = 5 + frame[1]*256 + frame[2]
+        key = bytes( frame[6:statusPos] ) + chr( frame[statusPos] & ( 0xFF ^ REPEATER_COUNT_MASK ) )
+        if key in seen:
+            self.suppressed = self.suppressed + 1
+            return True
+        if len( order ) >= self.capacity:
+            del seen[order.popleft()[1]]
+        seen[key] = now
+        order.append( ( now, key ) )
+        self.passed = self.passed + 1
+        return False
+
+    '''
+    Function    : DedupCache.stats
+    Description : Counters of the cache
+    Arguments   : none
+    Returns     : hash table with passed, suppressed and size
+    '''
+    def stats( self ):
+        return { 'passed'     : self.passed,
+                 'suppressed' : self.suppressed,
+                 'size'       : len( self.seen ) }
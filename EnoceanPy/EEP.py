@@ -0,0 +1,229 @@
+#  EEP.py -- Registry of EnOcean Equipment Profiles
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import importlib
+import struct
+
+import Metrics
+
+'''
+RADIO telegram data structure ( ERP1 ):
+
++--------+-------------------------+---------------+----------+
+|  RORG  |     payload ( 1..n )    |   Sender ID   |  Status  |
++--------+-------------------------+---------------+----------+
+
+Sender ID and status are always the last 5 bytes, so they are found without
+knowing the profile. The payload is decoded by the profile ( EEP ) of the
+sender, given as RORG-FUNC-TYPE.
+
+Profiles are implemented in modules of the profiles package, one module per
+RORG-FUNC ( eg. profiles/F6_02.py ). A profile module has
+    DEV             : short device class name ( eg. 'RCKR' )
+    getDecoder(type): returns decode( raw, offset, length ) -> hash table of
+                      values in engineering units, where raw[offset] is RORG
+                      and length is the data length including RORG
+Modules are imported only when a telegram needs them.
+'''
+
+'''
+Profile modules by ( RORG, FUNC )
+'''
+_profileModules = {
+    ( 0xF6, 0x02 ) : 'F6_02',      # Rocker switch, 2 rocker
+    ( 0xD5, 0x00 ) : 'D5_00',      # Contacts and switches
+    ( 0xA5, 0x02 ) : 'A5_02',      # Temperature sensors
+}
+
+'''
+Profile assumed for senders without an assigned profile, by RORG
+'''
+_defaultProfiles = {
+    0xF6 : ( 0x02, 0x01 ),
+    0xD5 : ( 0x00, 0x01 ),
+    0xA5 : ( 0x02, 0x05 ),
+}
+
+_senderStruct = struct.Struct( '>I' )
+
+'''
+Class       : Profile
+Description : One RORG-FUNC-TYPE profile. The decoder is loaded from its
+              profile module on first use.
+'''
+class Profile( object ):
+    __slots__ = ( 'rorg', 'func', 'type', 'name', 'dev', 'decoder' )
+
+    def __init__( self, rorg, func, type, dev = None, decoder = None ):
+        self.rorg = rorg
+        self.func = func
+        self.type = type
+        self.name = '%02X-%02X-%02X' %( rorg, func, type )
+        self.dev = dev
+        self.decoder = decoder
+
+    '''
+    Function    : Profile.load
+    Description : Imports the profile module and takes the decoder from it
+    Arguments   : none
+    Returns     : none, raises KeyError if the profile is not supported
+    '''
+    def load( self ):
+        moduleName = _profileModules.get( ( self.rorg, self.func ) )
+        if moduleName is None:
+            raise KeyError( 'EEP %s not supported' %( self.name ) )
+        module = _importProfile( moduleName )
+        self.dev = module.DEV
+        self.decoder = module.getDecoder( self.type )
+
+'''
+Registered profiles by ( RORG, FUNC, TYPE )
+'''
+_profiles = {}
+
+'''
+Profile to use for each RORG, indexed by RORG
+'''
+_byRorg = [ None ] * 256
+
+'''
+Profile to use for each sender, by integer sender ID
+'''
+_byDevice = {}
+
+'''
+Telegrams with no profile for their RORG, by RORG
+'''
+_unknownRorg = Metrics.counter( 'enocean_unknown_rorg_total', 'RADIO telegrams with no profile for their RORG',
+                                labels = ( 'rorg', ) )
+
+_package = __name__.rpartition( '.' )[0]
+
+def _importProfile( name ):
+    moduleName = 'profiles.' + name
+    if _package:
+        moduleName = _package + '.' + moduleName
+    return importlib.import_module( moduleName )
+
+'''
+Function    : EEP_register
+Description : Registers a profile decoder, replacing the profile module one
+Arguments   : rorg, func, type - profile
+              dev     - short device class name
+              decoder - decode( raw, offset, length ) -> hash table of values
+Returns     : none
+'''
+def register( rorg, func, type, dev, decoder ):
+    profile = getProfile( rorg, func, type )
+    profile.dev = dev
+    profile.decoder = decoder
+
+'''
+Function    : EEP_getProfile
+Description : Gives the Profile object for a RORG-FUNC-TYPE
+Arguments   : rorg, func, type - profile
+Returns     : Profile
+'''
+def getProfile( rorg, func, type ):
+    key = ( rorg, func, type )
+    profile = _profiles.get( key )
+    if profile is None:
+        profile = Profile( rorg, func, type )
+        _profiles[key] = profile
+    return profile
+
+'''
+Function    : _supportedProfile
+Description : Gives the Profile object for a RORG-FUNC-TYPE, loading its
+              decoder now so that an unsupported profile fails while
+              configuring rather than when its first telegram comes in
+Arguments   : rorg, func, type - profile
+Returns     : Profile, raises KeyError if the profile is not supported
+'''
+def _supportedProfile( rorg, func, type ):
+    profile = getProfile( rorg, func, type )
+    if profile.decoder is None:
+        profile.load()
+    return profile
+
+'''
+Function    : EEP_setDefault
+Description : Sets the profile used for senders of a RORG without an assigned
+              profile
+Arguments   : rorg, func, type - profile
+Returns     : none, raises KeyError if the profile is not supported
+'''
+def setDefault( rorg, func, type ):
+    _byRorg[rorg] = _supportedProfile( rorg, func, type )
+
+'''
+Function    : EEP_assign
+Description : Assigns a profile to a sender
+Arguments   : senderId         - sender ID as number
+              rorg, func, type - profile
+Returns     : none, raises KeyError if the profile is not supported
+'''
+def assign( senderId, rorg, func, type ):
+    _byDevice[senderId] = _supportedProfile( rorg, func, type )
+
+# the built-in defaults are known to be supported, their modules are still
+# imported only when a telegram needs them
+for _rorg in _defaultProfiles:
+    _byRorg[_rorg] = getProfile( _rorg, *_defaultProfiles[_rorg] )
+
+'''
+Function    : EEP_decode
+Description : Decodes the data of a RADIO telegram by the profile of its sender
+Arguments   : raw    - raw packet
+              offset - position of RORG in raw
+              length - data length
+Returns     : hash table with
+                dev     : device class ( eg. 'RCKR' ), 'UKWN' if no profile
+                eep     : profile as 'RR-FF-TT', if known
+                id      : sender ID as bytearray of 4
+                sender  : sender ID as number
+                data    : payload, a number if 1 byte else bytearray
+                status  : status byte
+                values  : decoded values, if profile known
+'''
+def decode( raw, offset, length ):
+    if length < 6:
+        return { 'dev' : 'UKWN' }
+    idStart = offset + length - 5
+    sender = _senderStruct.unpack_from( raw, idStart )[0]
+    decodedData = {
+        'id'        : raw[idStart:idStart+4],
+        'sender'    : sender,
+        'status'    : raw[idStart+4]
+    }
+    if length == 7:
+        decodedData['data'] = raw[offset+1]
+    else:
+        decodedData['data'] = raw[offset+1:idStart]
+    profile = _byDevice.get( sender ) or _byRorg[raw[offset]]
+    if profile is None:
+        _unknownRorg.labels( '%02X' %( raw[offset] ) ).inc()
+        decodedData['dev'] = 'UKWN'
+        return decodedData
+    if profile.decoder is None:
+        profile.load()
+    decodedData['dev'] = profile.dev
+    decodedData['eep'] = profile.name
+    decodedData['values'] = profile.decoder( raw, offset, length )
+    return decodedData
@@ -24,6 +24,47 @@ import serial
 import os
 import time
 import sys
+import select
+import threading
+import Queue
+
+import ESP
+import Capture
+import Clock
+import Metrics
+
+'''
+Data received while waiting for a command RESPONSE which is not part of that
+response. Kept per port and handed out by the next receiveData call.
+'''
+_backlog = {}
+
+'''
+Background readers started with startReader, per port
+'''
+_readers = {}
+
+'''
+Capture files being written, per port
+'''
+_captures = {}
+
+'''
+Runtime metrics of the serial ports
+'''
+_bytesRead = Metrics.counter( 'enocean_bytes_read_total', 'Bytes read from gateway ports' )
+_bytesWritten = Metrics.counter( 'enocean_bytes_written_total', 'Bytes written to gateway ports' )
+
+'''
+ESP3 gives up a packet not completed within 100 ms
+'''
+PACKET_GAP = 0.1
+
+'''
+Overflow policies of RingBuffer
+'''
+DROP_OLDEST = 'DROP_OLDEST'
+DROP_NEWEST = 'DROP_NEWEST'
 
 '''
 Function    : EO_connect
@@ -43,30 +84,185 @@ Description : Acts as the interface to EnOcean gateway device
 Arguments   : 2
               hSerial - handle to serial port to which device is connected
               rawData - data to send as list in raw ( number, base:dec ) format
-Returns     : stream of raw data received as response, empty list if no response
+Returns     : raw RESPONSE packet received ( bytearray ), empty if no response
 '''
 
 def sendData( hSerial, rawData ):
-    for idx in range( len( rawData ) ):
-        hSerial.write( chr(rawData[idx]) )
-    time.sleep( 0.10 )
-    rawResp = receiveData( hSerial )
-    return rawResp
+    return sendCommand( hSerial, rawData )
+
+'''
+Function    : EO_sendCommand
+Description : Sends a command packet in a single write and waits for the
+              RESPONSE packet to it. Everything else received meanwhile is
+              passed on to the next receiveData call.
+Arguments   : hSerial - handle to serial port to which device is connected
+              rawData - complete command packet ( list of numbers, str or bytearray )
+              timeout - maximum time to wait for the RESPONSE, in seconds
+Returns     : raw RESPONSE packet ( bytearray ), empty bytearray on timeout
+'''
+def sendCommand( hSerial, rawData, timeout = 0.5 ):
+    reader = _readers.get( hSerial )
+    if reader:
+        return reader.command( rawData, timeout )
+    framer = ESP.Framer()
+    others = _backlog.setdefault( hSerial, bytearray() )
+    received = bytearray()
+    response = bytearray()
+    # whatever is already buffered was sent before this command
+    others.extend( _readPort( hSerial ) )
+    writeData( hSerial, rawData )
+    deadline = time.time() + timeout
+    while not response:
+        data = _readPort( hSerial )
+        received.extend( data )
+        for frame in framer.feed( data ):
+            if frame[4] == ESP.ESP_packetTypes['RESPONSE']:
+                response = frame
+                break
+        if response:
+            break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        select.select( [hSerial], [], [], remaining )
+    # pass on everything else in the order it was received
+    if response:
+        start = received.find( response )
+        del received[start:start+len( response )]
+    others.extend( received )
+    return response
 
 '''
 Function    : EO_receiveData
-Description : Acts as the read interface to EnOcean gateway device
+Description : Acts as the read interface to EnOcean gateway device. Everything
+              buffered by the port is drained with a single read. If a reader
+              is running, the packets it collected are returned instead.
 Arguments   : hSerial - handle to serial port to read from
-Returns     : stream of raw data read, empty list if nothing read
+Returns     : stream of raw data read as bytearray, empty bytearray if nothing read
 '''
 def receiveData( hSerial ):
-    data = []
-    while hSerial.inWaiting() != 0:
-        #~ data.append( hSerial.read(1).encode("hex") )
-        data.append( ord(hSerial.read(1)) )
-        time.sleep( 0.001 )
+    reader = _readers.get( hSerial )
+    if reader:
+        data = bytearray()
+        for frame, started, completed in reader.ring.getAll():
+            data.extend( frame )
+        return data
+    data = _backlog.pop( hSerial, bytearray() )
+    data.extend( _readPort( hSerial ) )
+    return data
+
+'''
+Function    : EO_receivePackets
+Description : Waits in select() until at least one complete packet is received
+              or timeout passes, without using CPU meanwhile. Once part of a
+              packet is in, the rest must follow within gap seconds, otherwise
+              the partial packet is given up ( see ESP.Framer.resync ).
+Arguments   : hSerial - handle to serial port to which device is connected
+              framer  - ESP.Framer kept by the caller for this port
+              timeout - maximum time to wait in seconds, None to wait forever
+              gap     - maximum time between bytes of a packet in seconds
+              times   - list to which ( started, completed ) is appended for
+                        each packet: Clock.monotonic times of the read its
+                        first byte came in and of the read completing it
+Returns     : list of raw packets ( bytearrays ), empty if timed out
+'''
+def receivePackets( hSerial, framer, timeout = None, gap = PACKET_GAP, times = None ):
+    reader = _readers.get( hSerial )
+    if reader:
+        first = reader.ring.get( timeout )
+        if first is None:
+            return []
+        items = [ first ] + reader.ring.getAll()
+        if times is not None:
+            times.extend( ( started, completed ) for frame, started, completed in items )
+        return [ item[0] for item in items ]
+    deadline = None if timeout is None else time.time() + timeout
+    timed = times is not None
+    frames = framer.feed( _backlog.pop( hSerial, bytearray() ), Clock.monotonic() if timed else None )
+    if timed:
+        times.extend( framer.frameTimes )
+    while True:
+        partial = framer.pending()
+        if frames and not partial:
+            return frames
+        if partial:
+            wait = gap
+        elif deadline is None:
+            wait = None
+        else:
+            wait = deadline - time.time()
+            if wait <= 0:
+                return frames
+        readable, _, _ = select.select( [hSerial], [], [], wait )
+        if readable:
+            data = _readPort( hSerial )
+            if not data:
+                # readable without data, eg. device unplugged
+                return frames
+            frames.extend( framer.feed( data, Clock.monotonic() if timed else None ) )
+            if timed:
+                times.extend( framer.frameTimes )
+        elif partial:
+            while framer.pending():
+                frames.extend( framer.resync() )
+                if timed:
+                    times.extend( framer.frameTimes )
+
+'''
+Function    : _readPort
+Description : Reads everything buffered by the port with a single read
+Arguments   : hSerial - handle to serial port to read from
+Returns     : raw data read as bytearray, empty bytearray if nothing read
+'''
+def _readPort( hSerial ):
+    nBytes = hSerial.inWaiting()
+    if nBytes == 0:
+        return bytearray()
+    data = bytearray( hSerial.read( nBytes ) )
+    _bytesRead.inc( len( data ) )
+    capture = _captures.get( hSerial )
+    if capture:
+        capture.write( data, Capture.RX )
     return data
 
+'''
+Function    : EO_writeData
+Description : Writes raw data to the gateway in a single write
+Arguments   : hSerial - handle to serial port
+              rawData - data to send ( list of numbers, str or bytearray )
+Returns     : none
+'''
+def writeData( hSerial, rawData ):
+    data = rawData if isinstance( rawData, str ) else bytes( bytearray( rawData ) )
+    capture = _captures.get( hSerial )
+    if capture:
+        capture.write( data, Capture.TX )
+    hSerial.write( data )
+    _bytesWritten.inc( len( data ) )
+
+'''
+Function    : EO_startCapture
+Description : Starts recording all data read from and written to the port,
+              with timestamps, to a capture file ( see Capture.py )
+Arguments   : hSerial - handle to serial port
+              path    - capture file name, overwritten if it exists
+Returns     : none
+'''
+def startCapture( hSerial, path ):
+    stopCapture( hSerial )
+    _captures[hSerial] = Capture.CaptureWriter( path )
+
+'''
+Function    : EO_stopCapture
+Description : Stops recording and closes the capture file, if any
+Arguments   : hSerial - handle to serial port
+Returns     : none
+'''
+def stopCapture( hSerial ):
+    capture = _captures.pop( hSerial, None )
+    if capture:
+        capture.close()
+
 '''
 Function    : EO_disconnect
 Description : closes the connection to EO gateway
@@ -74,4 +270,236 @@ Arguments   : hSerial - handle to serial port to close connection
 Returns     : none
 '''
 def disconnect( hSerial ):
+    stopReader( hSerial )
+    stopCapture( hSerial )
+    _backlog.pop( hSerial, None )
     hSerial.close()
+
+'''
+Class       : RingBuffer
+Description : Bounded FIFO of packets in preallocated slots. When full, either
+              the oldest queued packet or the new one is dropped, as chosen by
+              policy, and the drop is counted.
+'''
+class RingBuffer( object ):
+
+    def __init__( self, capacity, policy = DROP_OLDEST ):
+        if policy not in ( DROP_OLDEST, DROP_NEWEST ):
+            raise ValueError( 'Unknown overflow policy %s' %( policy ) )
+        self.slots = [ None ] * capacity
+        self.capacity = capacity
+        self.policy = policy
+        self.head = 0               # index of oldest packet
+        self.count = 0              # number of packets queued
+        self.received = 0           # packets offered with put
+        self.dropped = 0            # packets lost to overflow
+        self.highWater = 0          # maximum number of packets queued
+        self.condition = threading.Condition()
+
+    '''
+    Function    : RingBuffer.put
+    Description : Queues a packet, applying the overflow policy if full
+    Arguments   : item - packet to queue
+    Returns     : True if item was queued, False if it was dropped
+    '''
+    def put( self, item ):
+        with self.condition:
+            self.received = self.received + 1
+            if self.count == self.capacity:
+                self.dropped = self.dropped + 1
+                if self.policy == DROP_NEWEST:
+                    return False
+                # overwrite the oldest packet
+                self.slots[self.head] = item
+                self.head = ( self.head + 1 ) % self.capacity
+            else:
+                self.slots[( self.head + self.count ) % self.capacity] = item
+                self.count = self.count + 1
+                if self.count > self.highWater:
+                    self.highWater = self.count
+            self.condition.notify()
+            return True
+
+    '''
+    Function    : RingBuffer.get
+    Description : Takes out the oldest packet, waiting for one if empty
+    Arguments   : timeout - maximum time to wait in seconds, None to wait forever
+    Returns     : oldest packet, None if timed out
+    '''
+    def get( self, timeout = None ):
+        with self.condition:
+            if self.count == 0:
+                if timeout is None:
+                    while self.count == 0:
+                        self.condition.wait()
+                else:
+                    self.condition.wait( timeout )
+                    if self.count == 0:
+                        return None
+            return self._pop()
+
+    '''
+    Function    : RingBuffer.getAll
+    Description : Takes out every queued packet without waiting
+    Arguments   : none
+    Returns     : list of packets, oldest first
+    '''
+    def getAll( self ):
+        with self.condition:
+            items = []
+            while self.count:
+                items.append( self._pop() )
+            return items
+
+    '''
+    Function    : RingBuffer.stats
+    Description : Snapshot of the buffer counters
+    Arguments   : none
+    Returns     : hash table with capacity, policy, queued, received,
+                  dropped and highWater
+    '''
+    def stats( self ):
+        with self.condition:
+            return { 'capacity'  : self.capacity,
+                     'policy'    : self.policy,
+                     'queued'    : self.count,
+                     'received'  : self.received,
+                     'dropped'   : self.dropped,
+                     'highWater' : self.highWater }
+
+    def _pop( self ):
+        item = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = ( self.head + 1 ) % self.capacity
+        self.count = self.count - 1
+        return item
+
+'''
+Class       : Reader
+Description : Background thread which keeps draining a port, so that nothing
+              is lost in the UART while the application is busy. Packets go
+              into a RingBuffer as ( packet, started, completed ), with the
+              read times given by Framer.frameTimes, RESPONSE packets to a
+              waiting command. As in receivePackets, a partial packet not
+              completed within PACKET_GAP is given up.
+'''
+class Reader( threading.Thread ):
+
+    def __init__( self, hSerial, ring, framer = None ):
+        threading.Thread.__init__( self, name = 'EO reader' )
+        self.daemon = True
+        self.hSerial = hSerial
+        self.ring = ring
+        self.framer = framer or ESP.Framer()
+        self.running = True
+        self.waiting = False                # a command waits for its RESPONSE
+        self.responses = Queue.Queue()
+        self.commandLock = threading.Lock()
+
+    def run( self ):
+        framer = self.framer
+        while self.running:
+            readable, _, _ = select.select( [self.hSerial], [], [], 0.1 if not framer.pending() else PACKET_GAP )
+            if not readable:
+                if framer.pending() and Clock.monotonic() - framer.lastRead >= PACKET_GAP:
+                    # rest of the packet did not come in time
+                    while framer.pending():
+                        self._deliver( framer.resync() )
+                continue
+            data = _readPort( self.hSerial )
+            if not data:
+                # readable without data, eg. device unplugged
+                print 'ERROR : No data from readable port, reader stopped'
+                self.running = False
+                break
+            self._deliver( framer.feed( data, Clock.monotonic() ) )
+
+    def _deliver( self, frames ):
+        for frame, ( started, completed ) in zip( frames, self.framer.frameTimes ):
+            if self.waiting and frame[4] == ESP.ESP_packetTypes['RESPONSE']:
+                self.waiting = False
+                self.responses.put( frame )
+            else:
+                self.ring.put( ( frame, started, completed ) )
+
+    '''
+    Function    : Reader.command
+    Description : Sends a command packet and waits for the RESPONSE collected
+                  by the reader thread
+    Arguments   : rawData - complete command packet
+                  timeout - maximum time to wait for the RESPONSE, in seconds
+    Returns     : raw RESPONSE packet ( bytearray ), empty bytearray on timeout
+    '''
+    def command( self, rawData, timeout ):
+        with self.commandLock:
+            # forget a RESPONSE which came in after an earlier timeout
+            while not self.responses.empty():
+                self.responses.get_nowait()
+            self.waiting = True
+            writeData( self.hSerial, rawData )
+            try:
+                return self.responses.get( True, timeout )
+            except Queue.Empty:
+                return bytearray()
+            finally:
+                self.waiting = False
+
+'''
+Function    : EO_startReader
+Description : Starts a background thread which drains the port into a ring
+              buffer. receiveData, readPacket and sendCommand use it from then on.
+Arguments   : hSerial  - handle to serial port
+              capacity - number of packets the ring buffer holds
+              policy   - DROP_OLDEST or DROP_NEWEST, what to drop when full
+              framer   - ESP.Framer to use, eg. one with allowed sender IDs;
+                         from then on only the reader thread may feed it
+Returns     : none
+'''
+def startReader( hSerial, capacity = 256, policy = DROP_OLDEST, framer = None ):
+    if hSerial in _readers:
+        return
+    reader = Reader( hSerial, RingBuffer( capacity, policy ), framer )
+    # hand over anything kept from earlier commands
+    readAt = Clock.monotonic()
+    for frame in reader.framer.feed( _backlog.pop( hSerial, bytearray() ), readAt ):
+        reader.ring.put( ( frame, readAt, readAt ) )
+    _readers[hSerial] = reader
+    reader.start()
+
+'''
+Function    : EO_stopReader
+Description : Stops the background reader of a port, if any. Packets not yet
+              taken out are passed on to the next receiveData call.
+Arguments   : hSerial - handle to serial port
+Returns     : none
+'''
+def stopReader( hSerial ):
+    reader = _readers.pop( hSerial, None )
+    if reader is None:
+        return
+    reader.running = False
+    reader.join()
+    backlog = _backlog.setdefault( hSerial, bytearray() )
+    for frame, started, completed in reader.ring.getAll():
+        backlog.extend( frame )
+    backlog.extend( reader.framer.buffer[reader.framer.offset:] )
+
+'''
+Function    : EO_readPacket
+Description : Takes out the oldest packet collected by the background reader
+Arguments   : hSerial - handle to serial port with a running reader
+              timeout - maximum time to wait in seconds, None to wait forever
+Returns     : raw packet ( bytearray ), None if timed out
+'''
+def readPacket( hSerial, timeout = None ):
+    item = _readers[hSerial].ring.get( timeout )
+    return item[0] if item else None
+
+'''
+Function    : EO_readerStats
+Description : Counters of the background reader, to measure packet loss
+Arguments   : hSerial - handle to serial port with a running reader
+Returns     : hash table as returned by RingBuffer.stats
+'''
+def readerStats( hSerial ):
+    return _readers[hSerial].ring.stats()
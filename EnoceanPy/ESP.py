@@ -20,6 +20,11 @@
 #  
 
 from pprint import pprint
+import binascii
+import struct
+
+import EEP
+import Metrics
 
 
 '''
@@ -85,6 +90,15 @@ lookupTable_CRC8 = [
   0xe6, 0xe1, 0xe8, 0xef, 0xfa, 0xfd, 0xf4, 0xf3
 ]
 
+'''
+Lookup Table for CRC8 over two bytes - entry ( a << 8 | b ) is the CRC8 of the
+bytes a, b starting from 0. With a running CRC c, the next two bytes a, b give
+lookupTable_CRC8_16[ (c ^ a) << 8 | b ]. Used for the 4 header bytes, which
+then need only two lookups.
+'''
+lookupTable_CRC8_16 = bytearray( lookupTable_CRC8[lookupTable_CRC8[a] ^ b]
+                                 for a in range( 256 ) for b in range( 256 ) )
+
 '''
 Packet type definitions
 '''
@@ -99,6 +113,32 @@ ESP_packetTypes = {
     'REMOTE_MAN_COMMAND': 0x07
 }
 
+'''
+Filter types of CO_WR_FILTER_ADD, CO_WR_FILTER_DEL and CO_RD_FILTER
+'''
+ESP_filterTypes = {
+    'SOURCE_ID'         : 0x00,
+    'RORG'              : 0x01,
+    'DBM'               : 0x02,
+    'DESTINATION_ID'    : 0x03
+}
+
+'''
+Return codes of RESPONSE packets
+'''
+ESP_returnCodes = {
+    'RET_OK'                : 0x00,
+    'RET_ERROR'             : 0x01,
+    'RET_NOT_SUPPORTED'     : 0x02,
+    'RET_WRONG_PARAM'       : 0x03,
+    'RET_OPERATION_DENIED'  : 0x04
+}
+
+'''
+Entry of the CO_RD_FILTER RESPONSE : filter type, filter value
+'''
+_filterEntry = struct.Struct( '>BI' )
+
 ESP_COMMON_COMMANDS = {
     'CO_WR_SLEEP'           : {
                         'CMD'       : 0x01,
@@ -324,11 +364,11 @@ ESP_COMMON_COMMANDS = {
                                 'LENGTH'    : 1,
                                 'TYPE'      : 'NUMBER'
                             },
-                            'DATA'      : {
-                                'NAME'      : 'Decoder Not Implemented',
+                            'FILTERS'   : {
+                                'NAME'      : 'Filters',
                                 'START'     : 1,
                                 'LENGTH'    : 'X',
-                                'TYPE'      : 'NUMBER'
+                                'TYPE'      : 'FILTER_LIST'
                             }
                         }
     },
@@ -376,9 +416,9 @@ ESP_COMMON_COMMANDS = {
                             },
                             'MEM_DATA'   : {
                                 'NAME'      : 'Memory Data',
-                                'START'     : 0,
+                                'START'     : 1,
                                 'LENGTH'    : 'X',
-                                'TYPE'      : 'BYTE'
+                                'TYPE'      : 'BYTE_ARRAY'
                             }
                         }
     },
@@ -444,56 +484,449 @@ ESP_COMMON_COMMANDS = {
 '''
 Function    : ESP_calcCRC8( data )
 Description : Calculates CRC8 of data provided
-Arguments   : data - list of raw data( ASCII code )
+Arguments   : data - raw data as bytearray, list of numbers, str or memoryview
 Returns     : calculated CRC8 sum
 '''
-def calcCRC8( data ):
+def calcCRC8( data, table = lookupTable_CRC8 ):
+    if isinstance( data, ( str, memoryview ) ):
+        data = bytearray( data )
     crc8Sum = 0
     for byte in data:
-        crc8Sum = lookupTable_CRC8[crc8Sum ^ byte]
+        crc8Sum = table[crc8Sum ^ byte]
     return crc8Sum
 
+'''
+Function    : ESP_calcCRC8Header
+Description : Calculates CRC8H of the packet header starting at pos, without
+              copying the header out
+Arguments   : buf - raw data as bytearray or list of numbers
+              pos - position of SYNC byte in buf
+Returns     : calculated CRC8 sum of the 4 bytes following SYNC byte
+'''
+def calcCRC8Header( buf, pos = 0 ):
+    table = lookupTable_CRC8_16
+    return table[( table[( buf[pos+1] << 8 ) | buf[pos+2]] ^ buf[pos+3] ) << 8 | buf[pos+4]]
+
+'''
+Function    : ESP_validHeaders
+Description : Checks CRC8H of many candidate packet starts in one pass, eg. all
+              SYNC bytes found after line noise
+Arguments   : buf       - raw data as bytearray or list of numbers
+              positions - candidate SYNC byte positions, each with at least
+                          6 bytes available in buf
+Returns     : list of positions with a valid header, in the given order
+'''
+def validHeaders( buf, positions ):
+    table = lookupTable_CRC8_16
+    return [ pos for pos in positions
+             if table[( table[( buf[pos+1] << 8 ) | buf[pos+2]] ^ buf[pos+3] ) << 8 | buf[pos+4]] == buf[pos+5] ]
+
+'''
+Function    : ESP_encodePacket
+Description : Builds a complete ESP3 packet with SYNC byte, header and both
+              CRC8 sums
+Arguments   : pktType - packet type, one of ESP_packetTypes
+              data    - data ( list of numbers, str or bytearray )
+              optData - optional data ( list of numbers, str or bytearray )
+Returns     : packet as str, ready to be written to the port
+'''
+def encodePacket( pktType, data, optData = () ):
+    body = bytearray( data )
+    dataLength = len( body )
+    body.extend( optData )
+    frame = bytearray( struct.pack( '>BHBB', 0x55, dataLength, len( body ) - dataLength, pktType ) )
+    frame.append( calcCRC8Header( frame ) )
+    frame.extend( body )
+    frame.append( calcCRC8( body ) )
+    return bytes( frame )
+
+'''
+Common commands without parameters, their packets never change
+'''
+ESP_FIXED_COMMANDS = ( 'CO_WR_RESET', 'CO_RD_VERSION', 'C0_RD_SYS_LOG', 'CO_WR_SYS_LOG',
+                       'CO_WR_BIST', 'CO_RD_IDBASE', 'CO_RD_REPEATER', 'CO_WR_FILTER_DEL_ALL',
+                       'CO_RD_FILTER', 'CO_RD_SECURITY' )
+
+'''
+Packets of ESP_FIXED_COMMANDS, built once at import
+'''
+_commandFrames = dict( ( cmd, encodePacket( ESP_packetTypes['COMMON_COMMAND'],
+                                            [ ESP_COMMON_COMMANDS[cmd]['CMD'] ] ) )
+                       for cmd in ESP_FIXED_COMMANDS )
+
+'''
+Function    : ESP_encodeCommand
+Description : Builds the packet of a common command. Packets of commands
+              without parameters come from a cache and cost nothing to build.
+Arguments   : cmd     - command name, key of ESP_COMMON_COMMANDS
+              params  - command parameters following the command code
+              optData - optional data
+Returns     : packet as str
+'''
+def encodeCommand( cmd, params = (), optData = () ):
+    if not params and not optData:
+        frame = _commandFrames.get( cmd )
+        if frame is not None:
+            return frame
+    data = bytearray( [ ESP_COMMON_COMMANDS[cmd]['CMD'] ] )
+    data.extend( params )
+    return encodePacket( ESP_packetTypes['COMMON_COMMAND'], data, optData )
+
+'''
+Function    : ESP_encodeRadio
+Description : Builds a RADIO packet to transmit an ERP1 telegram
+Arguments   : rorg        - RORG of the telegram
+              payload     - telegram data after RORG ( list of numbers, str or bytearray )
+              senderId    - sender ID as integer, 0 to use the gateway chip ID
+              status      - status byte
+              destination - destination ID as integer, broadcast by default
+Returns     : packet as str
+'''
+def encodeRadio( rorg, payload, senderId = 0, status = 0x00, destination = 0xFFFFFFFF ):
+    data = bytearray( [ rorg ] )
+    data.extend( payload )
+    data.extend( _senderId.pack( senderId ) )
+    data.append( status )
+    # send 3 subtelegrams, dBm 0xFF when sending, no security
+    optData = bytearray( [ 0x03 ] )
+    optData.extend( _senderId.pack( destination ) )
+    optData.extend( [ 0xFF, 0x00 ] )
+    return encodePacket( ESP_packetTypes['RADIO'], data, optData )
+
+'''
+Runtime metrics of the framer and packet decoder
+'''
+_framesTotal = Metrics.counter( 'enocean_frames_total', 'Packets found in the received stream' )
+_discardedBytes = Metrics.counter( 'enocean_discarded_bytes_total', 'Received bytes not part of any packet' )
+_crc8hErrors = Metrics.counter( 'enocean_crc8h_errors_total', 'SYNC bytes with an invalid header CRC8H' )
+_crc8dErrors = Metrics.counter( 'enocean_crc8d_errors_total', 'Packets with an invalid data CRC8D' )
+_rejectedFrames = Metrics.counter( 'enocean_rejected_frames_total', 'RADIO packets dropped by the sender ID filter' )
+
+'''
+Largest data plus optional data length the Framer accepts by default. Longer
+headers are taken as false SYNC bytes, so a false header costs at most this
+many bytes of CRC8D. Radio telegrams and responses to common commands are far
+shorter.
+'''
+MAX_DATA_LENGTH = 512
+
+'''
+Sender ID of a RADIO telegram, the 4 bytes before the status byte ending data
+'''
+_senderId = struct.Struct( '>I' )
+
+'''
+Class       : Framer
+Description : Incremental ESP3 stream framer. Raw data can be fed in arbitrary
+              chunks as it is read from the serial port; bytes of an incomplete
+              packet are kept until the rest arrives. Every byte is scanned only
+              once, no matter how the chunks are split. Packets are handed out
+              only when both CRC8H and CRC8D are valid.
+              With a set of allowed sender IDs, RADIO packets from other
+              senders are dropped by the framer, before anything is decoded.
+              Headers announcing more than maxLength bytes are taken as false
+              SYNC bytes, which bounds the work per received byte.
+'''
+class Framer( object ):
+
+    SYNC = '\x55'
+    SYNC_BATCH = 32             # SYNC candidates checked together after a false one
+
+    def __init__( self, allowed = None, maxLength = MAX_DATA_LENGTH ):
+        self.maxLength = maxLength  # largest data plus optional data length accepted
+        self.buffer = bytearray()   # received bytes not yet handed out
+        self.offset = 0             # start of unprocessed bytes in buffer
+        self.frameLength = 0        # length of frame at offset, 0 if header not validated yet
+        self.discarded = 0          # bytes skipped as not part of any packet
+        self.falseSyncs = 0         # SYNC bytes with an invalid header
+        self.crc8dErrors = 0        # valid headers followed by invalid data
+        self.rejected = 0           # RADIO packets dropped by sender ID
+        self.lastRead = None        # time of the last read given to feed
+        self.pendingSince = None    # time of the read the pending bytes started in
+        self.frameTimes = []        # ( started, completed ) of packets of the last feed
+        self.setAllowed( allowed )
+
+    '''
+    Function    : Framer.setAllowed
+    Description : Sets the sender IDs whose RADIO packets are passed on
+    Arguments   : allowed - sender IDs as integers, None to pass all packets
+    Returns     : none
+    '''
+    def setAllowed( self, allowed ):
+        self.allowed = None if allowed is None else frozenset( allowed )
+
+    '''
+    Function    : Framer.feed
+    Description : Appends a chunk of raw data and extracts the completed packets.
+                  Between packets the buffer is searched for the next SYNC byte
+                  with bytearray.find, so line noise is skipped at C speed and
+                  every byte is looked at a bounded number of times. After a
+                  false SYNC byte, the following candidates are checked
+                  together with validHeaders.
+                  With the time of the read, frameTimes then holds for each
+                  packet the time of the read its first byte came in and of
+                  the read which completed it.
+    Arguments   : rawData - chunk of raw data ( list of numbers, str or bytearray )
+                  readAt  - time the chunk was read ( eg. Clock.monotonic ),
+                            None to keep the time of the last read
+    Returns     : list of complete packets as bytearrays, each returned only once
+    '''
+    def feed( self, rawData, readAt = None ):
+        frames = []
+        times = self.frameTimes = []
+        if readAt is None:
+            readAt = self.lastRead
+        else:
+            self.lastRead = readAt
+        startedAt = self.pendingSince if self.pendingSince is not None else readAt
+        buf = self.buffer
+        fresh = len( buf )          # first byte of this chunk
+        buf.extend( rawData )
+        pos = self.offset
+        end = len( buf )
+        discarded = 0
+        falseSyncs = 0
+        crc8dErrors = 0
+        rejected = 0
+        allowed = self.allowed
+        maxLength = self.maxLength
+        while pos < end:
+            if self.frameLength == 0:
+                sync = buf.find( self.SYNC, pos )
+                if sync < 0:
+                    discarded = discarded + end - pos
+                    pos = end
+                    break
+                discarded = discarded + sync - pos
+                pos = sync
+                if end - pos < 6:
+                    # wait for the rest of header
+                    break
+                if calcCRC8Header( buf, pos ) != buf[pos+5] or \
+                   buf[pos+1]*256 + buf[pos+2] + buf[pos+3] > maxLength:
+                    # not a real SYNC byte, likely line noise: check the
+                    # headers of the next SYNC candidates in one pass
+                    candidates = []
+                    sync = buf.find( self.SYNC, pos + 1, end - 5 )
+                    while sync >= 0 and len( candidates ) < self.SYNC_BATCH:
+                        candidates.append( sync )
+                        sync = buf.find( self.SYNC, sync + 1, end - 5 )
+                    valid = validHeaders( buf, candidates )
+                    if valid:
+                        nextPos = valid[0]
+                        falseSyncs = falseSyncs + 1 + candidates.index( nextPos )
+                    elif candidates:
+                        nextPos = candidates[-1] + 1
+                        falseSyncs = falseSyncs + 1 + len( candidates )
+                    else:
+                        nextPos = pos + 1
+                        falseSyncs = falseSyncs + 1
+                    discarded = discarded + nextPos - pos
+                    pos = nextPos
+                    continue
+                self.frameLength = 6 + buf[pos+1]*256 + buf[pos+2] + buf[pos+3] + 1
+            if end - pos < self.frameLength:
+                # wait for rest of the packet
+                break
+            if calcCRC8( buf[pos+6:pos+self.frameLength-1] ) != buf[pos+self.frameLength-1]:
+                # eg. a truncated packet followed by a good one: the header
+                # was right but the length spans both, look for the next SYNC
+                crc8dErrors = crc8dErrors + 1
+                discarded = discarded + 1
+                pos = pos + 1
+                self.frameLength = 0
+                continue
+            if allowed is not None and buf[pos+4] == 0x01:
+                # sender ID ends 1 byte before data, data starts at pos + 6
+                idPos = pos + 1 + buf[pos+1]*256 + buf[pos+2]
+                if idPos >= pos + 7 and _senderId.unpack_from( buf, idPos )[0] not in allowed:
+                    rejected = rejected + 1
+                    pos = pos + self.frameLength
+                    self.frameLength = 0
+                    continue
+            frames.append( buf[pos:pos+self.frameLength] )
+            if readAt is not None:
+                times.append( ( startedAt if pos < fresh else readAt, readAt ) )
+            pos = pos + self.frameLength
+            self.frameLength = 0
+        if pos == end:
+            self.pendingSince = None
+        elif pos >= fresh or self.pendingSince is None:
+            self.pendingSince = readAt
+        # drop consumed bytes, only when it is cheap compared to what was consumed
+        if pos == end:
+            del buf[:]
+            pos = 0
+        elif pos >= end - pos:
+            del buf[:pos]
+            pos = 0
+        self.offset = pos
+        if discarded:
+            self.discarded = self.discarded + discarded
+            _discardedBytes.inc( discarded )
+            if falseSyncs:
+                self.falseSyncs = self.falseSyncs + falseSyncs
+                _crc8hErrors.inc( falseSyncs )
+        if crc8dErrors:
+            self.crc8dErrors = self.crc8dErrors + crc8dErrors
+            _crc8dErrors.inc( crc8dErrors )
+        if rejected:
+            self.rejected = self.rejected + rejected
+            _rejectedFrames.inc( rejected )
+        _framesTotal.inc( len( frames ) + rejected )
+        return frames
+
+    '''
+    Function    : Framer.stats
+    Description : Counters of the framer
+    Arguments   : none
+    Returns     : hash table with discarded bytes, false SYNC bytes, packets
+                  with an invalid CRC8D and rejected packets
+    '''
+    def stats( self ):
+        return { 'discarded' : self.discarded, 'falseSyncs' : self.falseSyncs,
+                 'crc8dErrors' : self.crc8dErrors, 'rejected' : self.rejected }
+
+    '''
+    Function    : Framer.pending
+    Description : Number of bytes kept for packets not yet complete
+    Arguments   : none
+    Returns     : number of pending bytes
+    '''
+    def pending( self ):
+        return len( self.buffer ) - self.offset
+
+    '''
+    Function    : Framer.reset
+    Description : Discards any partially received packet
+    Arguments   : none
+    Returns     : none
+    '''
+    def reset( self ):
+        del self.buffer[:]
+        self.offset = 0
+        self.frameLength = 0
+        self.pendingSince = None
+
+    '''
+    Function    : Framer.resync
+    Description : Gives up the partially received packet, eg. when the rest
+                  did not arrive in time, and scans the bytes after its SYNC
+                  byte again for packets. A false SYNC byte announcing a long
+                  packet thus no longer holds back the packets behind it.
+    Arguments   : none
+    Returns     : list of complete packets found in the kept bytes
+    '''
+    def resync( self ):
+        if self.pending() == 0:
+            return []
+        self.frameLength = 0
+        self.offset = self.offset + 1
+        self.discarded = self.discarded + 1
+        _discardedBytes.inc()
+        return self.feed( '' )
+
 '''
 Function    : ESP_decodeRawResponse
 Description : Decodes the raw response even when response has multiple packets
-Arguments   : rawData
+Arguments   : rawData - complete raw data; an incomplete packet at the end is
+              dropped, use a Framer for data read from a stream
 Returns     : list of decoded packets as hash table mentioned in ESP_decodePacket
 '''
 def decodeRawResponse( rawData ):
     listOfPackets = [] # This will hold the list of decode packets
-    processedBytes = 0
-    while( 1 ):
-        while( rawData[processedBytes] != 0x55 ):
-            processedBytes = processedBytes + 1
-            # if we don't have a valid SYNC byte in the entire byte stream,
-            # or SYNC byte of a packet in between is missing( very less chance )
-            if processedBytes >= len( rawData ):
-                return listOfPackets
-        # we got a sync byte, now check whether it's valid
-        crc8_calc = calcCRC8( rawData[processedBytes+1:processedBytes+5] )
-        if crc8_calc == rawData[processedBytes+5]: # if calculated CRC8 is equal to recieved CRC8, then valid starting
-            # detect datalength
-            dataLength = rawData[processedBytes+1]*256 + rawData[processedBytes+2] + rawData[processedBytes+3]
-            packet = rawData[ processedBytes: processedBytes+6+dataLength+1 ]
-            listOfPackets.append( decodePacket( packet ) )
-            processedBytes = processedBytes+6+dataLength+1
-        else:
-            # That may not be a correct SYNC byte,
-            # restart the procedure with next byte
-            processedBytes = processedBytes + 1
-        # check whether we reached the end of rawData
-        if processedBytes >= len( rawData ):
-            break
+    framer = Framer()
+    for frame in framer.feed( rawData ):
+        listOfPackets.append( decodePacket( frame ) )
+    # nothing more will come: a false SYNC byte announcing a long packet must
+    # not hide the packets behind it
+    while framer.pending():
+        listOfPackets.extend( decodePacket( frame ) for frame in framer.resync() )
     return listOfPackets
     
+'''
+Class       : Packet
+Description : Decoded ESP3 packet. Header fields are plain numbers and booleans;
+              data and optional data are memoryviews into the raw packet, so
+              nothing is copied. Use raw with DATA_OFFSET for integer access
+              to data bytes.
+              For compatibility, fields can also be read by the hash table
+              names described in ESP_decodePacket ( eg. pkt['data_recv'] ).
+'''
+class Packet( object ):
+    __slots__ = ( 'raw', 'sync', 'dataLength', 'optDataLen', 'pktType',
+                  'crc8hRecv', 'crc8hCalc', 'crc8hOk',
+                  'data', 'optData', 'crc8dRecv', 'crc8dCalc', 'crc8dOk' )
+
+    DATA_OFFSET = 6     # position of first data byte in raw
+
+    def __init__( self, raw ):
+        self.raw        = raw
+        self.sync       = False
+        self.dataLength = None
+        self.optDataLen = None
+        self.pktType    = None
+        self.crc8hRecv  = None
+        self.crc8hCalc  = None
+        self.crc8hOk    = None
+        self.data       = None
+        self.optData    = None
+        self.crc8dRecv  = None
+        self.crc8dCalc  = None
+        self.crc8dOk    = None
+
+    def __getitem__( self, key ):
+        value = _packetFields[key]( self )
+        if value is None:
+            raise KeyError( key )
+        return value
+
+    def __contains__( self, key ):
+        return key in _packetFields and _packetFields[key]( self ) is not None
+
+    def get( self, key, default = None ):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys( self ):
+        return [ key for key in _packetFields if key in self ]
+
+def _status( ok ):
+    if ok is None:
+        return None
+    return 'OK' if ok else 'NOT_OK'
+
+def _tolist( view ):
+    if view is None:
+        return None
+    return view.tolist()
+
+'''
+Hash table names of Packet fields, as used before Packet was introduced
+'''
+_packetFields = {
+    'Sync'          : lambda pkt: _status( pkt.sync ),
+    'dataLength'    : lambda pkt: pkt.dataLength,
+    'optDataLen'    : lambda pkt: pkt.optDataLen,
+    'pktType'       : lambda pkt: pkt.pktType,
+    'crc8h_recv'    : lambda pkt: pkt.crc8hRecv,
+    'crc8h_calc'    : lambda pkt: pkt.crc8hCalc,
+    'crc8h_stat'    : lambda pkt: _status( pkt.crc8hOk ),
+    'data_recv'     : lambda pkt: _tolist( pkt.data ),
+    'opData_recv'   : lambda pkt: _tolist( pkt.optData ),
+    'crc8d_recv'    : lambda pkt: pkt.crc8dRecv,
+    'crc8d_calc'    : lambda pkt: pkt.crc8dCalc,
+    'crc8d_stat'    : lambda pkt: _status( pkt.crc8dOk ),
+}
+
 '''
 Function    : ESP_decodePacket
 Description : decodes the given (single/first) raw data packet into fields
-Arguments   : rawData
-Returns     : a hashtable containing each field by name
-                Return hashtable contains these feilds
-                    Sync        : UN_IN  (not initialized)
-                                  NOT_OK (first byte is not SYNC byte )
+Arguments   : rawData - bytearray ( kept and referenced by the Packet ), list
+                        of numbers or str
+Returns     : a Packet, whose fields can also be read by these names
+                    Sync        : NOT_OK (first byte is not SYNC byte )
                                   OK     ( First byte is SYNC byte )
                     dataLength  : length of data ( 16bits )
                     optDataLen  : optional data length ( 8bits )
@@ -508,106 +941,188 @@ Returns     : a hashtable containing each field by name
                     crc8d_calc  : calculated CRC8D
                     crc8d_stat  : OK - crc8d_recv == crc8d_calc
                                   NOT_OK - otherwise
+                Fields after a failed check are not available.
 '''
 def decodePacket( rawData ):
-    packetInfo = {}    
-    packetInfo[ 'Sync' ] = 'UN_IN'
-    
+    if not isinstance( rawData, bytearray ):
+        rawData = bytearray( rawData )
+    packet = Packet( rawData )
+
     if( rawData[0] != 0x55 ):
-        packetInfo[ 'Sync' ] = 'NOT_OK'
-        return packetInfo
-    else:
-        packetInfo[ 'Sync' ] = 'OK'
-    
+        return packet
+    packet.sync = True
+
     # Extract header
-    packetInfo[ 'dataLength' ] = rawData[1]*256+rawData[2]
-    packetInfo[ 'optDataLen' ] = rawData[3]
-    packetInfo[ 'pktType' ]    = rawData[4]
-    packetInfo[ 'crc8h_recv' ] = rawData[5]
-    packetInfo[ 'crc8h_calc' ] = calcCRC8( rawData[1:5] )
-    if( packetInfo['crc8h_calc'] == packetInfo['crc8h_recv'] ):
-        packetInfo['crc8h_stat'] = 'OK'
-    else:
-        packetInfo['crc8h_stat'] = 'NOT_OK'
-        return packetInfo           # Return with partially filled
-    
+    dataLength = rawData[1]*256 + rawData[2]
+    optDataLen = rawData[3]
+    packet.dataLength = dataLength
+    packet.optDataLen = optDataLen
+    packet.pktType    = rawData[4]
+    packet.crc8hRecv  = rawData[5]
+    packet.crc8hCalc  = calcCRC8Header( rawData )
+    packet.crc8hOk    = packet.crc8hCalc == packet.crc8hRecv
+    if not packet.crc8hOk:
+        return packet           # Return with partially filled
+
     # Extract data
-    packetInfo[ 'data_recv' ]   = rawData[6:6+packetInfo['dataLength']]
-    packetInfo[ 'opData_recv' ] = rawData[6+packetInfo['dataLength']:6+packetInfo['dataLength']+packetInfo['optDataLen']]
-    packetInfo[ 'crc8d_recv' ]  = rawData[6+packetInfo['dataLength']+packetInfo['optDataLen']]
-    packetInfo[ 'crc8d_calc' ]  = calcCRC8( rawData[ 6:6+packetInfo['dataLength']+packetInfo['optDataLen']] )
-    if( packetInfo['crc8d_calc'] == packetInfo['crc8d_recv'] ):
-        packetInfo['crc8d_stat'] = 'OK'
-    else:
-        packetInfo['crc8d_stat'] = 'NOT_OK'
+    end = 6 + dataLength + optDataLen
+    view = memoryview( rawData )
+    packet.data      = view[6:6+dataLength]
+    packet.optData   = view[6+dataLength:end]
+    packet.crc8dRecv = rawData[end]
+    packet.crc8dCalc = calcCRC8( rawData[6:end] )
+    packet.crc8dOk   = packet.crc8dCalc == packet.crc8dRecv
+    if not packet.crc8dOk:
+        _crc8dErrors.inc()
 
-    return packetInfo
+    return packet
 
 '''
 Function    : ESP_decodeRadioData
-Description : decode each field in data part of a RADIO telegram into a hash table
-Arguments   : pktInfo -- decoded Packet info table as generated by ESP_decodePacket
-Returns     : none
+Description : decode each field in data part of a RADIO telegram into a hash table,
+              using the EEP profile registered for the sender
+Arguments   : pktInfo -- Packet as generated by ESP_decodePacket
+Returns     : hash table as described in EEP_decode
 '''
-# @TODO: remove harcoded detection
 def decodeRadioData( pktInfo ):
-    decodedData = {}
-    # Check radio type
-    if( pktInfo['data_recv'][0] == 0xF6 ):   # 2-rocker swicth
-        decodedData['dev']      = 'RCKR'
-        decodedData['id']       = pktInfo['data_recv'][2:6]
-        decodedData['data']     = pktInfo['data_recv'][1]
-        decodedData['status']   = pktInfo['data_recv'][6]
-    elif( pktInfo['data_recv'][0] == 0xD5 ):
-        decodedData['dev']      = 'CNCT'
-        decodedData['id']       = pktInfo['data_recv'][2:6]
-        decodedData['data']     = pktInfo['data_recv'][1]
-        decodedData['status']   = pktInfo['data_recv'][6]
-    elif( pktInfo['data_recv'][0] == 0xA5 ):    # TEMP
-        decodedData['dev']      = 'TEMP'
-        decodedData['id']       = pktInfo['data_recv'][5:9]
-        decodedData['data']     = pktInfo['data_recv'][1:5]
-        decodedData['status']   = pktInfo['data_recv'][-1]
-    else:
-        decodedData['dev']      = 'UKWN'
+    return EEP.decode( pktInfo.raw, Packet.DATA_OFFSET, pktInfo.dataLength )
+
+
+'''
+Conversion of raw field bytes ( str ) to the value of each field TYPE
+'''
+def _toNumber( rawBytes ):
+    if not rawBytes:
+        return 0
+    return int( binascii.hexlify( rawBytes ), 16 )
+
+def _toByteArray( rawBytes ):
+    return list( bytearray( rawBytes ) )
 
-    return decodedData
+def _toAscii( rawBytes ):
+    return rawBytes
 
+def _toFilterList( rawBytes ):
+    return [ _filterEntry.unpack_from( rawBytes, pos )
+             for pos in range( 0, len( rawBytes ) - _filterEntry.size + 1, _filterEntry.size ) ]
+
+_fieldConverters = {
+    'NUMBER'        : _toNumber,
+    'BYTE_ARRAY'    : _toByteArray,
+    'ASCII'         : _toAscii,
+    'FILTER_LIST'   : _toFilterList
+}
+
+'''
+struct codes for NUMBER fields which can be unpacked directly
+'''
+_numberCodes = { 1 : 'B', 2 : 'H', 4 : 'I' }
+
+'''
+Class       : ResponseDecoder
+Description : Decoder for the data of a RESPONSE to one of ESP_COMMON_COMMANDS.
+              The fixed length fields are unpacked with a single precompiled
+              struct; a variable length ( 'X' ) field takes the rest of data.
+'''
+class ResponseDecoder( object ):
+
+    def __init__( self, fields ):
+        fixed = []
+        self.tail = None            # ( name, start, converter ) of 'X' field
+        for field in fields.values():
+            converter = _fieldConverters[field['TYPE']]
+            if field['LENGTH'] == 'X':
+                self.tail = ( field['NAME'], field['START'], converter )
+            else:
+                fixed.append( ( field['START'], field['LENGTH'], field['TYPE'],
+                                field['NAME'], converter ) )
+        fixed.sort()
+        fmt = '>'
+        pos = 0
+        self.names = []
+        self.converters = []        # ( index, converter ) of values to convert
+        self.fields = []            # ( name, end, struct, converter ) for short data
+        for start, length, fieldType, name, converter in fixed:
+            if start < pos:
+                raise ValueError( 'Overlapping response field %s' %( name ) )
+            if start > pos:
+                fmt = fmt + '%dx' %( start - pos )
+            if fieldType == 'NUMBER' and length in _numberCodes:
+                code = _numberCodes[length]
+                converter = None
+            else:
+                code = '%ds' %( length )
+            if converter:
+                self.converters.append( ( len( self.names ), converter ) )
+            self.names.append( name )
+            self.fields.append( ( name, start + length,
+                                  struct.Struct( '>%dx%s' %( start, code ) ), converter ) )
+            fmt = fmt + code
+            pos = start + length
+        self.struct = struct.Struct( fmt )
+
+    '''
+    Function    : ResponseDecoder.decode
+    Description : Decodes the data part of a RESPONSE packet
+    Arguments   : buf    - raw data ( bytearray, str or memoryview )
+                  offset - position of first data byte in buf
+                  length - number of data bytes
+    Returns     : hash table of field values by field name. Fields not
+                  present in a short RESPONSE ( eg. an error ) are left out.
+    '''
+    def decode( self, buf, offset, length ):
+        if length >= self.struct.size:
+            values = list( self.struct.unpack_from( buf, offset ) )
+            for index, converter in self.converters:
+                values[index] = converter( values[index] )
+            decodedData = dict( zip( self.names, values ) )
+        else:
+            decodedData = {}
+            for name, end, fieldStruct, converter in self.fields:
+                if end > length:
+                    break
+                value = fieldStruct.unpack_from( buf, offset )[0]
+                if converter:
+                    value = converter( value )
+                decodedData[name] = value
+        if self.tail:
+            name, start, converter = self.tail
+            if length >= start:
+                decodedData[name] = converter( bytes( buf[offset+start:offset+length] ) )
+        return decodedData
+
+'''
+Decoders compiled from ESP_COMMON_COMMANDS, filled in by getResponseDecoder
+'''
+_responseDecoders = {}
+
+'''
+Function    : ESP_getResponseDecoder
+Description : Gives the decoder for the RESPONSE of a common command, compiling
+              it from ESP_COMMON_COMMANDS on first use
+Arguments   : cmd -- command name, key of ESP_COMMON_COMMANDS
+Returns     : ResponseDecoder, None if command is not known
+'''
+def getResponseDecoder( cmd ):
+    decoder = _responseDecoders.get( cmd )
+    if decoder is None and cmd in ESP_COMMON_COMMANDS:
+        decoder = ResponseDecoder( ESP_COMMON_COMMANDS[cmd]['RESPONSE'] )
+        _responseDecoders[cmd] = decoder
+    return decoder
 
 '''
 Function    : ESP_decodeResponseData
 Description : decode each field in data part of a RESPONSE telegram into a hash table
-Arguments   : pktInfo -- decoded Packet info table as generated by ESP_decodePacket
-Returns     : none
+Arguments   : pktInfo -- Packet as generated by ESP_decodePacket
+              cmd     -- command the RESPONSE is for, key of ESP_COMMON_COMMANDS
+Returns     : hash table of field values by field name, empty if cmd is not known
 '''
 def decodeResponseData( pktInfo, cmd ):
-    decodedData = {}
-    # variables to hold decoded data
-    l_fieldName = "NONE"
-    l_fieldValue = 0
-    l_fieldStart = 0
-    l_fieldEnd = 0
-    if cmd in ESP_COMMON_COMMANDS:
-        for field in ESP_COMMON_COMMANDS[cmd]['RESPONSE']:            
-            l_fieldName = ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['NAME']
-            l_fieldStart = ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['START']
-            l_fieldEnd = l_fieldStart + ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['LENGTH']
-            
-            if ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['TYPE'] == 'BYTE_ARRAY':
-                l_fieldValue = pktInfo['data_recv'][l_fieldStart:l_fieldEnd]
-            elif ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['TYPE'] == 'NUMBER':
-                l_fieldValue = 0;
-                for byte in pktInfo['data_recv'][l_fieldStart:l_fieldEnd]:
-                    l_fieldValue = l_fieldValue*256 + byte
-            elif ESP_COMMON_COMMANDS[cmd]['RESPONSE'][field]['TYPE'] == 'ASCII':
-                l_fieldValue = ''.join( chr(i) for i in pktInfo['data_recv'][l_fieldStart:l_fieldEnd] )
-            else:
-                l_fieldValue = pktInfo['data_recv'][l_fieldStart:l_fieldEnd+1]
-            decodedData[l_fieldName] = l_fieldValue
-    else:
+    decoder = getResponseDecoder( cmd )
+    if decoder is None:
         print 'ERROR : Command %s not supported' %( cmd )
-    
-    return decodedData
+        return {}
+    return decoder.decode( pktInfo.raw, Packet.DATA_OFFSET, pktInfo.dataLength )
 
 '''
 Function    : displayPacketInfo
@@ -636,13 +1151,15 @@ def displayPacketInfo( pktInfo, cmd = 'NO_CMD' ):
     elif pktInfo['pktType'] == ESP_packetTypes['RADIO']:
         dataFields = decodeRadioData( pktInfo )
         for field in dataFields.keys():
-            if( type(dataFields[field]) == list ):
+            if( type(dataFields[field]) in (list, bytearray) ):
                 print "        %-9s :" %(field),
                 for i in range(len(dataFields[field])):
                     print "%02X" %(dataFields[field][i]),
                 print ''
             elif( type(dataFields[field]) == str ):
                 print "        %-9s : %s" %(field,dataFields[field])
+            elif( type(dataFields[field]) == dict ):
+                print "        %-9s : %s" %(field, ', '.join( "%s=%r" %( key, val ) for ( key, val ) in dataFields[field].iteritems() ))
             else:
                 print "        %-9s : %02X" %(field,dataFields[field])
     elif pktInfo['pktType'] == ESP_packetTypes['RESPONSE']:
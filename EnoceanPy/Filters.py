@@ -0,0 +1,144 @@
+#  Filters.py -- Gateway filter table kept in sync with a device allowlist
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import struct
+
+import EO
+import ESP
+
+'''
+Usage :
+    filters = Filters.FilterManager( hEOGateway, [ 0x0015E43A, 0x0082A345 ] )
+    filters.sync()              # at start and after every reconnect
+
+The gateway forwards only RADIO telegrams from the allowed sender IDs, so
+telegrams of other devices never reach the serial port. The filter table is
+read back with CO_RD_FILTER and only the differences are written, so a sync
+against an up to date gateway costs two commands: reading the table and
+enabling filtering, whose state cannot be read back.
+'''
+
+'''
+Filter kind of CO_WR_FILTER_ADD : telegrams matching a filter are passed to
+the serial port, others are dropped
+'''
+FILTER_APPLY = 0x80
+
+'''
+Filter operator of CO_WR_FILTER_ENABLE : a telegram matching any filter passes
+'''
+FILTER_OR = 0x00
+
+_addParams = struct.Struct( '>BIB' )
+_delParams = struct.Struct( '>BI' )
+
+'''
+Class       : FilterManager
+Description : Keeps the filter table of a gateway equal to an allowlist of
+              sender IDs
+'''
+class FilterManager( object ):
+
+    def __init__( self, hSerial, allowed = () ):
+        self.hSerial = hSerial
+        self.allowed = set( allowed )       # sender IDs as integers
+        self.added = 0
+        self.deleted = 0
+        self.errors = 0
+
+    '''
+    Function    : FilterManager.setAllowed
+    Description : Replaces the allowlist, sync() pushes it to the gateway
+    Arguments   : allowed - sender IDs as integers
+    Returns     : none
+    '''
+    def setAllowed( self, allowed ):
+        self.allowed = set( allowed )
+
+    '''
+    Function    : FilterManager.reconnected
+    Description : Uses a new port handle after reconnecting and syncs again
+    Arguments   : hSerial - handle to serial port of the gateway
+    Returns     : as sync
+    '''
+    def reconnected( self, hSerial ):
+        self.hSerial = hSerial
+        return self.sync()
+
+    '''
+    Function    : FilterManager.read
+    Description : Reads the filter table of the gateway
+    Arguments   : none
+    Returns     : set of ( filter type, filter value ), None on error
+    '''
+    def read( self ):
+        fields = self._command( 'CO_RD_FILTER' )
+        if fields is None:
+            return None
+        return set( fields.get( 'Filters', [] ) )
+
+    '''
+    Function    : FilterManager.sync
+    Description : Deletes filters not in the allowlist, adds the missing ones
+                  and enables filtering. With an empty allowlist filtering is
+                  disabled, so that all telegrams are received.
+    Arguments   : none
+    Returns     : True if the gateway filters as configured
+    '''
+    def sync( self ):
+        current = self.read()
+        if current is None:
+            return False
+        sourceId = ESP.ESP_filterTypes['SOURCE_ID']
+        wanted = set( ( sourceId, senderId ) for senderId in self.allowed )
+        if not wanted:
+            return self._command( 'CO_WR_FILTER_ENABLE', [ 0x00, FILTER_OR ] ) is not None
+        for filterType, value in sorted( current - wanted ):
+            if self._command( 'CO_WR_FILTER_DEL', _delParams.pack( filterType, value ) ) is None:
+                return False
+            self.deleted = self.deleted + 1
+        for filterType, value in sorted( wanted - current ):
+            if self._command( 'CO_WR_FILTER_ADD', _addParams.pack( filterType, value, FILTER_APPLY ) ) is None:
+                # eg. filter table full, receive everything rather than miss devices
+                self._command( 'CO_WR_FILTER_ENABLE', [ 0x00, FILTER_OR ] )
+                return False
+            self.added = self.added + 1
+        return self._command( 'CO_WR_FILTER_ENABLE', [ 0x01, FILTER_OR ] ) is not None
+
+    '''
+    Function    : FilterManager.stats
+    Description : Counters of the manager
+    Arguments   : none
+    Returns     : hash table with filters added, deleted and failed commands
+    '''
+    def stats( self ):
+        return { 'added' : self.added, 'deleted' : self.deleted, 'errors' : self.errors }
+
+    def _command( self, cmd, params = () ):
+        rawResp = EO.sendCommand( self.hSerial, ESP.encodeCommand( cmd, bytearray( params ) ) )
+        if not rawResp:
+            print 'ERROR : No response to %s' %( cmd )
+            self.errors = self.errors + 1
+            return None
+        fields = ESP.decodeResponseData( ESP.decodePacket( rawResp ), cmd )
+        if fields.get( 'Return Code' ) != ESP.ESP_returnCodes['RET_OK']:
+            print 'ERROR : %s returned %r' %( cmd, fields.get( 'Return Code' ) )
+            self.errors = self.errors + 1
+            return None
+        return fields
@@ -0,0 +1,168 @@
+#  Gateways.py -- Several EnOcean gateways served by one event loop
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import sys
+from collections import deque, OrderedDict
+
+import Dedup
+import EO
+import ESP
+import Loop
+
+'''
+Usage :
+    manager = Gateways.GatewayManager()
+    manager.open( "/dev/ttyUSB0" )
+    manager.open( "/dev/ttyUSB1" )
+    for name, pkt in manager.packets():
+        ESP.displayPacketInfo( pkt )
+
+All ports are watched by a single Loop.EventLoop in the calling thread. A
+telegram heard by more than one gateway, or repeated, is passed on only once:
+the first gateway to deliver it wins.
+'''
+
+'''
+Class       : GatewayManager
+Description : Opens several gateway ports on one event loop and merges their
+              packets into one stream, each tagged with the gateway it came from
+'''
+class GatewayManager( object ):
+
+    def __init__( self, loop = None, dedup = None ):
+        self.loop = loop or Loop.EventLoop()
+        self.dedup = dedup or Dedup.DedupCache()    # shared by all gateways
+        self.gateways = OrderedDict()               # name -> Loop.Gateway
+        self.received = deque()                     # ( name, pkt ) not yet consumed
+        self.onPacket = None                        # optional callback( name, pkt ) for every packet
+
+    '''
+    Function    : GatewayManager.open
+    Description : Connects to a gateway and starts serving it
+    Arguments   : portID - port name to which gateway device is connected
+                  name   - name to tag its packets with, portID if not given
+    Returns     : the Loop.Gateway
+    '''
+    def open( self, portID, name = None ):
+        return self.add( EO.connect( portID ), name or portID )
+
+    '''
+    Function    : GatewayManager.add
+    Description : Starts serving an already connected gateway
+    Arguments   : hSerial - handle to serial port to which device is connected
+                  name    - name to tag its packets with
+    Returns     : the Loop.Gateway
+    '''
+    def add( self, hSerial, name ):
+        if name in self.gateways:
+            raise ValueError( 'Gateway %s already open' %( name ) )
+        gateway = Loop.Gateway( self.loop, hSerial )
+        gateway.accept = self._accept
+        gateway.onPacket = lambda pkt: self._onPacket( name, pkt )
+        self.gateways[name] = gateway
+        return gateway
+
+    '''
+    Function    : GatewayManager.sendCommand
+    Description : Queues a command packet for one gateway, see
+                  Loop.Gateway.sendCommand
+    Arguments   : name     - gateway name
+                  rawData  - complete command packet
+                  callback - called with the decoded RESPONSE packet, or None
+                  timeout  - maximum time to wait for the RESPONSE, in seconds
+    Returns     : none
+    '''
+    def sendCommand( self, name, rawData, callback, timeout = 0.5 ):
+        self.gateways[name].sendCommand( rawData, callback, timeout )
+
+    '''
+    Function    : GatewayManager.packets
+    Description : Iterates over packets of all gateways in the order they
+                  arrived, running the event loop whenever none are available
+    Arguments   : none
+    Returns     : generator of ( gateway name, decoded packet )
+    '''
+    def packets( self ):
+        while True:
+            while self.received:
+                yield self.received.popleft()
+            self.loop.runOnce()
+
+    '''
+    Function    : GatewayManager.close
+    Description : Stops serving a gateway and closes its port
+    Arguments   : name - gateway name, all gateways if not given
+    Returns     : none
+    '''
+    def close( self, name = None ):
+        names = [ name ] if name else self.gateways.keys()
+        for name in names:
+            self.gateways.pop( name ).close()
+
+    '''
+    Function    : GatewayManager.stats
+    Description : Counters of the manager
+    Arguments   : none
+    Returns     : hash table with de-duplication counters and the framer
+                  counters of every gateway
+    '''
+    def stats( self ):
+        return { 'dedup'    : self.dedup.stats(),
+                 'gateways' : dict( ( name, gateway.framer.stats() )
+                                    for name, gateway in self.gateways.iteritems() ) }
+
+    def _accept( self, frame ):
+        return not self.dedup.isDuplicate( frame )
+
+    def _onPacket( self, name, pkt ):
+        if self.onPacket:
+            self.onPacket( name, pkt )
+        else:
+            self.received.append( ( name, pkt ) )
+
+'''
+Function    : main
+Description : Monitors all gateways given on command line
+Arguments   : port names on command line, /dev/ttyAMA0 if none
+Returns     : none
+'''
+def main():
+    manager = GatewayManager()
+    for portID in sys.argv[1:] or [ "/dev/ttyAMA0" ]:
+        manager.open( portID )
+    try:
+        for name, pkt in manager.packets():
+            print "%-16s" %( name ),
+            telegram = {}
+            if pkt.pktType == ESP.ESP_packetTypes['RADIO'] and pkt.crc8dOk:
+                telegram = ESP.decodeRadioData( pkt )
+            if telegram.get( 'dev', 'UKWN' ) != 'UKWN':
+                print "%08X %s %s" %( telegram['sender'], telegram['dev'], telegram['values'] )
+            elif 'sender' in telegram:
+                # RORG without a profile, show the payload
+                print "%08X UKWN" %( telegram['sender'] ),
+                print ' '.join( "%02X" %( byte ) for byte in pkt['data_recv'] )
+            else:
+                print ' '.join( "%02X" %( byte ) for byte in pkt['data_recv'] )
+    except KeyboardInterrupt:
+        print manager.stats()
+        manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#  Loop.py -- Single threaded event loop for EnOcean gateways
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import heapq
+import select
+import time
+from collections import deque
+
+import EO
+import ESP
+
+'''
+Usage :
+    loop    = Loop.EventLoop()
+    gateway = Loop.Gateway( loop, EO.connect( "/dev/ttyAMA0" ) )
+    gateway.sendCommand( cmd, onResponse )
+    # other sockets ( eg. MQTT client socket ) can be added with addReader
+    for pkt in gateway.packets():
+        ESP.displayPacketInfo( pkt )
+
+The loop sleeps in select() until one of the registered files is readable
+or a timer is due, so an idle gateway costs no CPU.
+'''
+
+'''
+Class       : Timer
+Description : Handle for a callback scheduled with EventLoop.callLater
+'''
+class Timer( object ):
+
+    def __init__( self, when, callback, args ):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__( self, other ):
+        return self.when < other.when
+
+    '''
+    Function    : Timer.cancel
+    Description : Prevents the callback from being called
+    Arguments   : none
+    Returns     : none
+    '''
+    def cancel( self ):
+        self.cancelled = True
+
+'''
+Class       : EventLoop
+Description : select() based event loop running readers and timers in the
+              calling thread
+'''
+class EventLoop( object ):
+
+    def __init__( self ):
+        self.readers = {}       # file object -> callback
+        self.writers = {}       # file object -> callback
+        self.timers = []        # heap of Timer
+        self.running = False
+
+    '''
+    Function    : EventLoop.addReader
+    Description : Calls callback( fileObj ) whenever fileObj is readable
+    Arguments   : fileObj  - any object with fileno()
+                  callback - function to call
+    Returns     : none
+    '''
+    def addReader( self, fileObj, callback ):
+        self.readers[fileObj] = callback
+
+    '''
+    Function    : EventLoop.removeReader
+    Description : Stops watching fileObj for reading
+    Arguments   : fileObj - object given to addReader
+    Returns     : none
+    '''
+    def removeReader( self, fileObj ):
+        self.readers.pop( fileObj, None )
+
+    '''
+    Function    : EventLoop.addWriter
+    Description : Calls callback( fileObj ) whenever fileObj is writable
+    Arguments   : fileObj  - any object with fileno()
+                  callback - function to call
+    Returns     : none
+    '''
+    def addWriter( self, fileObj, callback ):
+        self.writers[fileObj] = callback
+
+    '''
+    Function    : EventLoop.removeWriter
+    Description : Stops watching fileObj for writing
+    Arguments   : fileObj - object given to addWriter
+    Returns     : none
+    '''
+    def removeWriter( self, fileObj ):
+        self.writers.pop( fileObj, None )
+
+    '''
+    Function    : EventLoop.callLater
+    Description : Schedules callback( *args ) after delay seconds
+    Arguments   : delay    - delay in seconds
+                  callback - function to call
+    Returns     : Timer which can be cancelled
+    '''
+    def callLater( self, delay, callback, *args ):
+        timer = Timer( time.time() + delay, callback, args )
+        heapq.heappush( self.timers, timer )
+        return timer
+
+    '''
+    Function    : EventLoop.runOnce
+    Description : Waits for the next event and dispatches all ready callbacks
+    Arguments   : timeout - maximum time to wait in seconds, None to wait
+                            until something happens
+    Returns     : none
+    '''
+    def runOnce( self, timeout = None ):
+        while self.timers and self.timers[0].cancelled:
+            heapq.heappop( self.timers )
+        if self.timers:
+            untilTimer = max( 0, self.timers[0].when - time.time() )
+            if timeout is None or untilTimer < timeout:
+                timeout = untilTimer
+        if self.readers or self.writers:
+            readable, writable, _ = select.select( self.readers.keys(),
+                                                   self.writers.keys(),
+                                                   [], timeout )
+        else:
+            readable, writable = [], []
+            if timeout:
+                time.sleep( timeout )
+        for fileObj in readable:
+            callback = self.readers.get( fileObj )
+            if callback:
+                callback( fileObj )
+        for fileObj in writable:
+            callback = self.writers.get( fileObj )
+            if callback:
+                callback( fileObj )
+        now = time.time()
+        while self.timers and self.timers[0].when <= now:
+            timer = heapq.heappop( self.timers )
+            if not timer.cancelled:
+                timer.callback( *timer.args )
+
+    '''
+    Function    : EventLoop.runForever
+    Description : Dispatches events until stop() is called
+    Arguments   : none
+    Returns     : none
+    '''
+    def runForever( self ):
+        self.running = True
+        while self.running:
+            self.runOnce()
+
+    '''
+    Function    : EventLoop.stop
+    Description : Makes runForever return after the current iteration
+    Arguments   : none
+    Returns     : none
+    '''
+    def stop( self ):
+        self.running = False
+
+'''
+Class       : Gateway
+Description : Connects an EnOcean gateway port to an EventLoop. Received data
+              is framed as it arrives; RESPONSE packets complete the pending
+              command, every other packet goes to the packet stream. A
+              partial packet not completed within EO.PACKET_GAP is given up
+              ( see ESP.Framer.resync ).
+'''
+class Gateway( object ):
+
+    def __init__( self, loop, hSerial ):
+        self.loop = loop
+        self.hSerial = hSerial
+        self.framer = ESP.Framer()
+        self.received = deque()     # decoded packets not yet consumed
+        self.commands = deque()     # ( rawData, callback, timeout ) waiting to be sent
+        self.current = None         # ( callback, timer ) of command waiting for RESPONSE
+        self.onPacket = None        # optional callback( pkt ) for every packet
+        self.accept = None          # optional accept( frame ), False drops a raw packet before decoding
+        self.gapTimer = None        # gives up a partial packet not completed in time
+        loop.addReader( hSerial, self._onReadable )
+
+    '''
+    Function    : Gateway.sendCommand
+    Description : Queues a command packet. Commands are sent one at a time and
+                  the next one goes out once the RESPONSE to the previous
+                  arrives or times out.
+    Arguments   : rawData  - complete command packet
+                  callback - called with the decoded RESPONSE packet, or None
+                             on timeout
+                  timeout  - maximum time to wait for the RESPONSE, in seconds
+    Returns     : none
+    '''
+    def sendCommand( self, rawData, callback, timeout = 0.5 ):
+        self.commands.append( ( rawData, callback, timeout ) )
+        if self.current is None:
+            self._sendNext()
+
+    '''
+    Function    : Gateway.packets
+    Description : Iterates over received packets, running the event loop
+                  whenever none are available
+    Arguments   : none
+    Returns     : generator of decoded packets as returned by ESP.decodePacket
+    '''
+    def packets( self ):
+        while True:
+            while self.received:
+                yield self.received.popleft()
+            self.loop.runOnce()
+
+    '''
+    Function    : Gateway.close
+    Description : Detaches from the event loop and closes the port
+    Arguments   : none
+    Returns     : none
+    '''
+    def close( self ):
+        self.loop.removeReader( self.hSerial )
+        if self.gapTimer:
+            self.gapTimer.cancel()
+            self.gapTimer = None
+        if self.current:
+            self.current[1].cancel()
+            self.current = None
+        self.commands.clear()
+        EO.disconnect( self.hSerial )
+
+    def _sendNext( self ):
+        if not self.commands:
+            return
+        rawData, callback, timeout = self.commands.popleft()
+        timer = self.loop.callLater( timeout, self._onTimeout )
+        self.current = ( callback, timer )
+        EO.writeData( self.hSerial, rawData )
+
+    def _onTimeout( self ):
+        callback = self.current[0]
+        self.current = None
+        self._sendNext()
+        callback( None )
+
+    def _onReadable( self, hSerial ):
+        data = EO.receiveData( hSerial )
+        if not data:
+            # readable without data, eg. device unplugged
+            print 'ERROR : No data from readable port, no longer reading it'
+            self.loop.removeReader( hSerial )
+            return
+        if self.gapTimer:
+            self.gapTimer.cancel()
+            self.gapTimer = None
+        self._dispatch( self.framer.feed( data ) )
+        if self.framer.pending():
+            self.gapTimer = self.loop.callLater( EO.PACKET_GAP, self._onGap )
+
+    def _onGap( self ):
+        self.gapTimer = None
+        while self.framer.pending():
+            self._dispatch( self.framer.resync() )
+
+    def _dispatch( self, frames ):
+        accept = self.accept
+        for frame in frames:
+            if accept and not accept( frame ):
+                continue
+            pkt = ESP.decodePacket( frame )
+            if pkt['pktType'] == ESP.ESP_packetTypes['RESPONSE'] and self.current:
+                callback, timer = self.current
+                timer.cancel()
+                self.current = None
+                self._sendNext()
+                callback( pkt )
+            elif self.onPacket:
+                self.onPacket( pkt )
+            else:
+                self.received.append( pkt )
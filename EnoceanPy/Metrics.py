@@ -0,0 +1,295 @@
+#  Metrics.py -- Runtime counters and histograms in Prometheus text format
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import os
+import threading
+from bisect import bisect_left
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+'''
+Usage :
+    frames = Metrics.counter( 'enocean_frames_total', 'Packets framed' )
+    frames.inc()
+    decodeTime = Metrics.histogram( 'enocean_decode_seconds', 'Decode time',
+                                    labels = ( 'stage', ) )
+    decodeTime.labels( 'radio' ).observe( 0.000012 )
+    Metrics.serve( 9108 )           # http://127.0.0.1:9108/metrics
+    Metrics.dump( '/run/enocean.prom' )
+
+Updating a metric is a plain attribute update without locking, cheap enough
+to stay enabled. Each metric is meant to be updated from one thread; reading
+it for exposition from another thread is safe.
+'''
+
+'''
+Default histogram buckets in seconds, from 10 us to 1 s
+'''
+DEFAULT_BUCKETS = ( 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0 )
+
+def _labelText( names, values, extra = '' ):
+    pairs = [ '%s="%s"' %( name, str( value ).replace( '\\', '\\\\' ).replace( '"', '\\"' ) )
+              for name, value in zip( names, values ) ]
+    if extra:
+        pairs.append( extra )
+    return '{%s}' %( ','.join( pairs ) ) if pairs else ''
+
+def _number( value ):
+    if value == float( 'inf' ):
+        return '+Inf'
+    return repr( float( value ) ) if isinstance( value, float ) else str( value )
+
+'''
+Class       : Counter
+Description : Value that only goes up. With func, the value is read from it
+              when exposed, eg. a counter kept by another object.
+'''
+class Counter( object ):
+
+    TYPE = 'counter'
+
+    def __init__( self, func = None ):
+        self.value = 0
+        self.func = func
+
+    '''
+    Function    : Counter.inc
+    Description : Adds to the counter
+    Arguments   : amount - amount to add
+    Returns     : none
+    '''
+    def inc( self, amount = 1 ):
+        self.value = self.value + amount
+
+    def samples( self, name, labelNames, labelValues ):
+        value = self.func() if self.func else self.value
+        return [ '%s%s %s' %( name, _labelText( labelNames, labelValues ), _number( value ) ) ]
+
+'''
+Class       : Gauge
+Description : Value that goes up and down, eg. a queue depth
+'''
+class Gauge( Counter ):
+
+    TYPE = 'gauge'
+
+    '''
+    Function    : Gauge.set
+    Description : Sets the value
+    Arguments   : value - new value
+    Returns     : none
+    '''
+    def set( self, value ):
+        self.value = value
+
+'''
+Class       : Histogram
+Description : Distribution of observed values in fixed buckets
+'''
+class Histogram( object ):
+
+    TYPE = 'histogram'
+
+    def __init__( self, buckets = DEFAULT_BUCKETS ):
+        self.bounds = list( buckets )
+        self.counts = [ 0 ] * ( len( self.bounds ) + 1 )     # last one is +Inf
+        self.sum = 0.0
+
+    '''
+    Function    : Histogram.observe
+    Description : Records a value
+    Arguments   : value - observed value
+    Returns     : none
+    '''
+    def observe( self, value ):
+        self.counts[bisect_left( self.bounds, value )] += 1
+        self.sum = self.sum + value
+
+    def samples( self, name, labelNames, labelValues ):
+        counts = list( self.counts )
+        lines = []
+        total = 0
+        for bound, count in zip( self.bounds + [ float( 'inf' ) ], counts ):
+            total = total + count
+            lines.append( '%s_bucket%s %d' %( name, _labelText( labelNames, labelValues,
+                                                                  'le="%s"' %( _number( bound ) ) ), total ) )
+        lines.append( '%s_sum%s %s' %( name, _labelText( labelNames, labelValues ), _number( self.sum ) ) )
+        lines.append( '%s_count%s %d' %( name, _labelText( labelNames, labelValues ), total ) )
+        return lines
+
+'''
+Class       : Family
+Description : Metric with a name, help text and optionally labels. With
+              labels, labels() gives the metric of each combination of label
+              values.
+'''
+class Family( object ):
+
+    def __init__( self, name, help, metricClass, labels = (), **options ):
+        self.name = name
+        self.help = help
+        self.metricClass = metricClass
+        self.labelNames = tuple( labels )
+        self.options = options
+        self.children = {}              # label values -> metric
+        self.lock = threading.Lock()
+        if not self.labelNames:
+            self.metric = metricClass( **options )
+            self.children[()] = self.metric
+
+    '''
+    Function    : Family.labels
+    Description : Metric of a combination of label values, created on first use
+    Arguments   : values - one value per label name
+    Returns     : Counter, Gauge or Histogram
+    '''
+    def labels( self, *values ):
+        metric = self.children.get( values )
+        if metric is None:
+            with self.lock:
+                metric = self.children.setdefault( values, self.metricClass( **self.options ) )
+        return metric
+
+    def exposition( self ):
+        lines = [ '# HELP %s %s' %( self.name, self.help ),
+                  '# TYPE %s %s' %( self.name, self.metricClass.TYPE ) ]
+        for values, metric in sorted( self.children.items() ):
+            lines.extend( metric.samples( self.name, self.labelNames, values ) )
+        return lines
+
+'''
+Class       : Registry
+Description : Collection of metrics exposed together
+'''
+class Registry( object ):
+
+    def __init__( self ):
+        self.families = {}              # name -> Family
+        self.lock = threading.Lock()
+
+    def _register( self, name, help, metricClass, labels, **options ):
+        with self.lock:
+            family = self.families.get( name )
+            if family is None:
+                family = Family( name, help, metricClass, labels, **options )
+                self.families[name] = family
+            elif family.metricClass is not metricClass:
+                raise ValueError( 'Metric %s already registered as %s' %( name, family.metricClass.TYPE ) )
+            elif 'func' in options:
+                family.metric.func = options['func']
+        if family.labelNames:
+            return family
+        return family.metric
+
+    def counter( self, name, help, labels = (), func = None ):
+        if func:
+            return self._register( name, help, Counter, labels, func = func )
+        return self._register( name, help, Counter, labels )
+
+    def gauge( self, name, help, labels = (), func = None ):
+        if func:
+            return self._register( name, help, Gauge, labels, func = func )
+        return self._register( name, help, Gauge, labels )
+
+    def histogram( self, name, help, labels = (), buckets = DEFAULT_BUCKETS ):
+        return self._register( name, help, Histogram, labels, buckets = buckets )
+
+    '''
+    Function    : Registry.exposition
+    Description : All metrics in Prometheus text format
+    Arguments   : none
+    Returns     : text
+    '''
+    def exposition( self ):
+        lines = []
+        for name in sorted( self.families ):
+            lines.extend( self.families[name].exposition() )
+        return '\n'.join( lines ) + '\n'
+
+'''
+Registry used by the EnoceanPy modules
+'''
+REGISTRY = Registry()
+
+'''
+Function    : counter, gauge, histogram
+Description : Register a metric in REGISTRY, or return the one already
+              registered under that name
+Arguments   : name    - metric name
+              help    - description
+              labels  - label names
+              func    - counter, gauge : function returning the value
+              buckets - histogram : upper bounds of the buckets
+Returns     : the metric, or its Family when labels are given
+'''
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+'''
+Function    : exposition
+Description : All metrics of REGISTRY in Prometheus text format
+Arguments   : none
+Returns     : text
+'''
+def exposition():
+    return REGISTRY.exposition()
+
+'''
+Function    : dump
+Description : Writes all metrics to a file, eg. for the node exporter textfile
+              collector. The file is replaced atomically.
+Arguments   : path - file name
+Returns     : none
+'''
+def dump( path ):
+    temporary = path + '.tmp'
+    with open( temporary, 'w' ) as output:
+        output.write( exposition() )
+    os.rename( temporary, path )
+
+class _MetricsHandler( BaseHTTPRequestHandler ):
+
+    def do_GET( self ):
+        if self.path.split( '?' )[0] not in ( '/', '/metrics' ):
+            self.send_error( 404 )
+            return
+        body = exposition()
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'text/plain; version=0.0.4' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):
+        pass
+
+'''
+Function    : serve
+Description : Serves all metrics over HTTP from a background thread
+Arguments   : port    - TCP port
+              address - address to listen on, local only by default
+Returns     : the HTTPServer, shutdown() stops it
+'''
+def serve( port, address = '127.0.0.1' ):
+    server = HTTPServer( ( address, port ), _MetricsHandler )
+    thread = threading.Thread( target = server.serve_forever, name = 'metrics' )
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,193 @@
+#  Rules.py -- Local automation rules reacting to decoded telegrams
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import Clock
+import ESP
+import Metrics
+import Transmit
+
+'''
+Usage :
+    engine = Rules.RuleEngine( { 'transmit' : Rules.transmitAction( transmitter ),
+                                 'publish'  : Rules.publishAction( publisher ) } )
+    engine.load( [
+        # ( sender ID, value name, value, action, arguments )
+        ( 0x0015E43A, 'action', 'AI', 'transmit', ( 0x0082A345, 0xF6, [ 0x30 ] ) ),
+        ( 0x0015E43A, 'action', 'BI', 'publish',  ( 'scenes/evening', 'on' ) ),
+        ( None,       'status', 0,    'publish',  ( 'alarm', 'open' ) ),
+    ] )
+    ...
+    telegram = ESP.decodeRadioData( pkt )
+    engine.run( telegram )
+
+A rule fires when a telegram of its sender ( None for any sender ) carries
+the value in its decoded values, eg. the rocker action AI of an F6-02
+telegram or status 0 ( open ) of a D5-00 contact. Rules are kept in a hash
+table keyed by ( sender, value name, value ), so finding the rules of a
+telegram takes one lookup per decoded value, whatever the number of rules.
+Values are compared for equality, so rules suit discrete events ( rocker
+actions, contacts ) rather than measurements.
+
+Actions are functions called as action( telegram, *arguments ) in the thread
+running the engine, they must not block.
+'''
+
+'''
+Class       : RuleEngine
+Description : Hash index of rules, from telegram values to actions
+'''
+class RuleEngine( object ):
+
+    def __init__( self, actions = None ):
+        self.actions = dict( actions or {} )    # action name -> function
+        self.index = {}                         # ( sender, name, value ) -> [ ( function, arguments ) ]
+        self.rules = 0
+        self.fired = 0
+        self.errors = 0
+        self.reaction = Metrics.histogram( 'enocean_rule_seconds',
+                                           'Time to run the actions of a telegram',
+                                           buckets = ( 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05 ) )
+
+    '''
+    Function    : RuleEngine.addAction
+    Description : Makes an action available to rules
+    Arguments   : name   - action name used in rules
+                  action - function called as action( telegram, *arguments )
+    Returns     : none
+    '''
+    def addAction( self, name, action ):
+        self.actions[name] = action
+
+    '''
+    Function    : RuleEngine.addRule
+    Description : Adds a rule to the index
+    Arguments   : sender    - sender ID as integer, None for any sender
+                  name      - name of the decoded value, eg. 'action'
+                  value     - value that fires the rule, eg. 'AI'
+                  action    - action name
+                  arguments - arguments passed to the action after the telegram
+    Returns     : True if added, False if the action is unknown
+    '''
+    def addRule( self, sender, name, value, action, arguments = () ):
+        function = self.actions.get( action )
+        if function is None:
+            print 'ERROR : Unknown action %s' %( action )
+            return False
+        self.index.setdefault( ( sender, name, value ), [] ).append( ( function, tuple( arguments ) ) )
+        self.rules = self.rules + 1
+        return True
+
+    '''
+    Function    : RuleEngine.load
+    Description : Replaces all rules
+    Arguments   : rules - ( sender, value name, value, action, arguments ) tuples
+    Returns     : number of rules loaded
+    '''
+    def load( self, rules ):
+        self.index = {}
+        self.rules = 0
+        for rule in rules:
+            self.addRule( *rule )
+        return self.rules
+
+    '''
+    Function    : RuleEngine.match
+    Description : Finds the actions of a telegram
+    Arguments   : telegram - hash table from ESP.decodeRadioData
+    Returns     : list of ( function, arguments )
+    '''
+    def match( self, telegram ):
+        index = self.index
+        if not index:
+            return []
+        sender = telegram['sender']
+        matched = []
+        for name, value in telegram['values'].iteritems():
+            try:
+                matched.extend( index.get( ( sender, name, value ), () ) )
+                matched.extend( index.get( ( None, name, value ), () ) )
+            except TypeError:
+                # unhashable value, no rule can name it
+                pass
+        return matched
+
+    '''
+    Function    : RuleEngine.run
+    Description : Runs the actions of a telegram. An action failing is
+                  reported and does not stop the others.
+    Arguments   : telegram - hash table from ESP.decodeRadioData
+    Returns     : number of actions run
+    '''
+    def run( self, telegram ):
+        matched = self.match( telegram )
+        if not matched:
+            return 0
+        started = Clock.monotonic()
+        for function, arguments in matched:
+            try:
+                function( telegram, *arguments )
+            except Exception as error:
+                print 'ERROR : Rule action for %08X failed : %s' %( telegram['sender'], error )
+                self.errors = self.errors + 1
+        self.reaction.observe( Clock.monotonic() - started )
+        self.fired = self.fired + len( matched )
+        return len( matched )
+
+    '''
+    Function    : RuleEngine.stats
+    Description : Counters of the engine
+    Arguments   : none
+    Returns     : hash table with rules loaded, actions run and failed
+    '''
+    def stats( self ):
+        return { 'rules' : self.rules, 'fired' : self.fired, 'errors' : self.errors }
+
+'''
+Function    : transmitAction
+Description : Action queueing a RADIO telegram, with arguments
+              ( destination, rorg, payload[, priority[, status]] ). status
+              defaults to 0x30 ( T21 and NU, a pressed rocker as sent by a
+              PTM switch ) for RORG 0xF6 and to 0x00 otherwise, receivers
+              ignore F6 telegrams without these bits.
+Arguments   : transmitter - Transmit.Transmitter
+              senderId    - sender ID of the telegrams, 0 for the gateway chip ID
+Returns     : action function
+'''
+def transmitAction( transmitter, senderId = 0 ):
+    def transmit( telegram, destination, rorg, payload, priority = Transmit.PRIORITY_HIGH, status = None ):
+        if status is None:
+            status = 0x30 if rorg == 0xF6 else 0x00
+        packet = ESP.encodeRadio( rorg, payload, senderId, status, destination )
+        if not transmitter.send( destination, packet, priority ):
+            print 'ERROR : Transmit queue full, telegram to %08X refused' %( destination )
+    return transmit
+
+'''
+Function    : publishAction
+Description : Action publishing a fixed MQTT message, with arguments
+              ( topic, payload )
+Arguments   : publisher - object with publish( topic, payload ), eg. the
+                          bridge Publisher
+              basePath  - prefix of the topics
+Returns     : action function
+'''
+def publishAction( publisher, basePath = '' ):
+    def publish( telegram, topic, payload ):
+        publisher.publish( basePath + topic, payload )
+    return publish
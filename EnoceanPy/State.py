@@ -0,0 +1,106 @@
+#  State.py -- Last known state of EnOcean devices
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import time
+
+'''
+Class       : DeviceState
+Description : Last decoded values of one device
+'''
+class DeviceState( object ):
+    __slots__ = ( 'sender', 'dev', 'values', 'updated',
+                  'publishedValues', 'published' )
+
+    def __init__( self, sender, dev ):
+        self.sender = sender
+        self.dev = dev
+        self.values = None              # last decoded values
+        self.updated = None             # time of last telegram
+        self.publishedValues = None     # values last reported as changed
+        self.published = None           # time of last report
+
+'''
+Class       : StateCache
+Description : Keeps the last decoded values of every device by sender ID and
+              decides when a new telegram is worth publishing: when a value
+              changed by more than its deadband, or when nothing was published
+              for maxSilence seconds.
+'''
+class StateCache( object ):
+
+    def __init__( self, deadbands = None, maxSilence = 900 ):
+        self.deadbands = deadbands or {}    # value name -> minimum change
+        self.maxSilence = maxSilence
+        self.devices = {}                   # sender ID -> DeviceState
+
+    '''
+    Function    : StateCache.update
+    Description : Stores the values of a new telegram
+    Arguments   : sender - sender ID as number
+                  dev    - device class, eg. 'TEMP'
+                  values - hash table of decoded values
+                  now    - current time, time.time() if not given
+    Returns     : True if the values should be published
+    '''
+    def update( self, sender, dev, values, now = None ):
+        if now is None:
+            now = time.time()
+        state = self.devices.get( sender )
+        if state is None:
+            state = DeviceState( sender, dev )
+            self.devices[sender] = state
+        state.values = values
+        state.updated = now
+        if ( state.publishedValues is not None and
+             now - state.published < self.maxSilence and
+             not self._changed( state.publishedValues, values ) ):
+            return False
+        state.publishedValues = values
+        state.published = now
+        return True
+
+    '''
+    Function    : StateCache.snapshot
+    Description : Current state of every device
+    Arguments   : none
+    Returns     : hash table by sender ID, each a hash table with dev, values,
+                  updated and published
+    '''
+    def snapshot( self ):
+        snapshot = {}
+        for sender, state in self.devices.items():
+            snapshot[sender] = { 'dev'       : state.dev,
+                                 'values'    : dict( state.values ),
+                                 'updated'   : state.updated,
+                                 'published' : state.published }
+        return snapshot
+
+    def _changed( self, old, new ):
+        if len( old ) != len( new ):
+            return True
+        for name, value in new.iteritems():
+            if name not in old:
+                return True
+            deadband = self.deadbands.get( name )
+            if deadband is not None and isinstance( value, ( int, long, float ) ):
+                if abs( value - old[name] ) > deadband:
+                    return True
+            elif value != old[name]:
+                return True
+        return False
@@ -0,0 +1,152 @@
+#  Trace.py -- Latency tracing of telegrams from serial read to publish
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import threading
+
+import Clock
+import Metrics
+
+'''
+Usage :
+    tracer = Trace.Tracer( sampleEvery = 100, log = open( 'trace.log', 'a' ) )
+    readAt = Clock.monotonic()              # right after reading the port
+    ...                                     # framing
+    trace = tracer.start( 'RCKR', sender, readAt, framedAt )
+    ...                                     # decoding
+    trace.decoded = Clock.monotonic()
+    trace.queued = Clock.monotonic()        # handed to the publisher
+    ...
+    tracer.finish( trace )                  # right after client.publish
+
+Every finished trace is counted in a latency histogram per device class
+( enocean_latency_seconds, see Metrics.py ). One trace out of sampleEvery is
+also written to the log with the time spent between each step.
+
+All timestamps come from Clock.monotonic.
+'''
+
+'''
+Histogram buckets for end to end latency, in seconds
+'''
+LATENCY_BUCKETS = ( 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0 )
+
+'''
+Class       : TelegramTrace
+Description : Timestamps of one telegram on its way through the bridge
+'''
+class TelegramTrace( object ):
+
+    __slots__ = ( 'dev', 'sender', 'read', 'framed', 'decoded', 'queued', 'published' )
+
+    def __init__( self, dev, sender, read, framed ):
+        self.dev = dev              # device class
+        self.sender = sender        # sender ID as integer
+        self.read = read            # data read from the port
+        self.framed = framed        # packet complete
+        self.decoded = None         # telegram decoded
+        self.queued = None          # handed to the publisher
+        self.published = None       # handed to the MQTT client
+
+'''
+Class       : Tracer
+Description : Collects finished traces into latency histograms and the
+              sampled trace log
+'''
+class Tracer( object ):
+
+    def __init__( self, sampleEvery = 0, log = None ):
+        self.sampleEvery = sampleEvery      # 0 never writes the log
+        self.log = log                      # file object for sampled traces
+        self.finished = 0
+        self.maximum = {}                   # device class -> highest latency seen
+        self.lock = threading.Lock()
+        self.latency = Metrics.histogram( 'enocean_latency_seconds',
+                                          'Time from serial read to MQTT publish',
+                                          labels = ( 'dev', ), buckets = LATENCY_BUCKETS )
+
+    '''
+    Function    : Tracer.start
+    Description : Starts the trace of a telegram
+    Arguments   : dev    - device class
+                  sender - sender ID as integer
+                  read   - time the data was read from the port
+                  framed - time the packet was complete
+    Returns     : TelegramTrace
+    '''
+    def start( self, dev, sender, read, framed ):
+        return TelegramTrace( dev, sender, read, framed )
+
+    '''
+    Function    : Tracer.finish
+    Description : Ends the trace of a published telegram
+    Arguments   : trace     - TelegramTrace from start
+                  published - time of publishing, now if not given
+    Returns     : end to end latency in seconds
+    '''
+    def finish( self, trace, published = None ):
+        if published is None:
+            published = Clock.monotonic()
+        trace.published = published
+        latency = published - trace.read
+        self.latency.labels( trace.dev ).observe( latency )
+        with self.lock:
+            self.finished = self.finished + 1
+            if latency > self.maximum.get( trace.dev, 0 ):
+                self.maximum[trace.dev] = latency
+            sample = self.log and self.sampleEvery and self.finished % self.sampleEvery == 0
+        if sample:
+            self.log.write( self.format( trace ) + '\n' )
+            self.log.flush()
+        return latency
+
+    '''
+    Function    : Tracer.format
+    Description : Formats a trace as one line with milliseconds spent in each
+                  step: read to framed, framed to decoded, decoded to queued,
+                  queued to published, and in total
+    Arguments   : trace - finished TelegramTrace
+    Returns     : line of text
+    '''
+    def format( self, trace ):
+        steps = [ trace.read, trace.framed, trace.decoded, trace.queued, trace.published ]
+        # a missing step takes the time of the one before
+        for i in range( 1, len( steps ) ):
+            if steps[i] is None:
+                steps[i] = steps[i-1]
+        return "%-4s %08X frame=%.3f decode=%.3f queue=%.3f publish=%.3f total=%.3f ms" %(
+            trace.dev, trace.sender,
+            ( steps[1] - steps[0] ) * 1000, ( steps[2] - steps[1] ) * 1000,
+            ( steps[3] - steps[2] ) * 1000, ( steps[4] - steps[3] ) * 1000,
+            ( steps[4] - steps[0] ) * 1000 )
+
+    '''
+    Function    : Tracer.summary
+    Description : Latency summary per device class
+    Arguments   : none
+    Returns     : hash table of device class -> hash table with count, mean
+                  and max latency in seconds
+    '''
+    def summary( self ):
+        result = {}
+        for ( dev, ), histogram in self.latency.children.items():
+            count = sum( histogram.counts )
+            result[dev] = { 'count' : count,
+                            'mean'  : histogram.sum / count if count else 0.0,
+                            'max'   : self.maximum.get( dev, 0.0 ) }
+        return result
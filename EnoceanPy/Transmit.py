@@ -0,0 +1,277 @@
+#  Transmit.py -- Paced transmission of RADIO telegrams
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import heapq
+import itertools
+import threading
+from collections import deque
+
+import Clock
+import EO
+import ESP
+
+'''
+Usage :
+    EO.startReader( hEOGateway )        # if other threads read the port
+    tx = Transmit.Transmitter( hEOGateway )
+    tx.start()
+    tx.send( 0x0015E43A, ESP.encodeRadio( 0xF6, [ 0x30 ], destination = 0x0015E43A ),
+             priority = Transmit.PRIORITY_HIGH, callback = onSent )
+    ...
+    tx.stop()
+
+Telegrams wait in one priority queue per destination. The transmitter always
+sends the most urgent telegram of all destinations next, oldest first among
+equal priorities. It sends one telegram at a time and waits for the RESPONSE
+of the gateway before the next one, so the gateway buffer never overruns. The
+return code of that RESPONSE is handed to the callback of the telegram.
+
+The time on air is kept within the duty cycle limit of the band ( 1 % per hour
+on 868.3 MHz ), counted over a sliding window of past transmissions. When the
+limit is reached, telegrams wait in their queues until enough airtime is free.
+'''
+
+PRIORITY_HIGH   = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW    = 2
+
+'''
+ERP1 radio : 125 kbit/s, each data byte sent as 12 bits, about 40 bits of
+preamble, SYNC and end per subtelegram
+'''
+BIT_RATE            = 125000.0
+BITS_PER_BYTE       = 12
+BITS_PER_SUBTEL     = 40
+
+'''
+Return codes after which a telegram is sent again, after backoff seconds
+'''
+RETRY_CODES = ( ESP.ESP_returnCodes['RET_ERROR'], ESP.ESP_returnCodes['RET_OPERATION_DENIED'] )
+
+'''
+Function    : airTime
+Description : Estimates the time on air of a RADIO packet
+Arguments   : packet - RADIO packet as built by ESP.encodeRadio
+Returns     : time on air in seconds, for all subtelegrams
+'''
+def airTime( packet ):
+    packet = bytearray( packet )
+    dataLength = packet[1]*256 + packet[2]
+    subTelegrams = packet[6+dataLength] if packet[3] else 1
+    return max( 1, subTelegrams ) * ( BITS_PER_SUBTEL + dataLength * BITS_PER_BYTE ) / BIT_RATE
+
+'''
+Class       : DutyCycle
+Description : Airtime used over a sliding window, to stay within a duty cycle
+'''
+class DutyCycle( object ):
+
+    def __init__( self, limit = 0.01, window = 3600.0 ):
+        self.budget = limit * window    # airtime allowed in any window, seconds
+        self.window = window
+        self.used = 0.0                 # airtime in the current window
+        self.history = deque()          # ( time, airtime ) of transmissions
+
+    def _expire( self, now ):
+        history = self.history
+        while history and history[0][0] <= now - self.window:
+            self.used = self.used - history.popleft()[1]
+
+    '''
+    Function    : DutyCycle.delay
+    Description : Time to wait before airtime seconds may be used
+    Arguments   : airtime - time on air of the next transmission
+                  now     - current time
+    Returns     : seconds to wait, 0 if it may go now
+    '''
+    def delay( self, airtime, now ):
+        self._expire( now )
+        if self.used + airtime <= self.budget:
+            return 0.0
+        # wait until old transmissions leave the window
+        needed = self.used + airtime - self.budget
+        for sent, used in self.history:
+            needed = needed - used
+            if needed <= 0:
+                return sent + self.window - now
+        return self.window
+
+    '''
+    Function    : DutyCycle.use
+    Description : Records a transmission
+    Arguments   : airtime - time on air
+                  now     - time of transmission
+    Returns     : none
+    '''
+    def use( self, airtime, now ):
+        self.history.append( ( now, airtime ) )
+        self.used = self.used + airtime
+
+'''
+Class       : Transmitter
+Description : Thread sending queued RADIO telegrams through a gateway, paced
+              by the gateway RESPONSE and the duty cycle
+'''
+class Transmitter( threading.Thread ):
+
+    def __init__( self, hSerial, dutyCycle = None, maxQueued = 256, timeout = 0.5,
+                  retries = 2, backoff = 0.1 ):
+        threading.Thread.__init__( self, name = 'EO transmitter' )
+        self.daemon = True
+        self.hSerial = hSerial
+        self.dutyCycle = dutyCycle or DutyCycle()
+        self.maxQueued = maxQueued
+        self.timeout = timeout          # wait for RESPONSE, seconds
+        self.retries = retries          # extra attempts after error or timeout
+        self.backoff = backoff          # wait before a retry, seconds
+        self.queues = {}                # destination -> heap of ( priority, seq, item )
+        self.heads = []                 # heap of ( priority, seq, destination ) of queue heads
+        self.queued = 0
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.airtime = 0.0
+
+    '''
+    Function    : Transmitter.send
+    Description : Queues a telegram without waiting
+    Arguments   : destination - destination ID, selects the queue
+                  packet      - RADIO packet, eg. from ESP.encodeRadio
+                  priority    - PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW
+                  callback    - called from the transmitter thread with the
+                                return code of the RESPONSE, None if no
+                                RESPONSE came after all retries
+    Returns     : True if queued, False if the queue is full
+    '''
+    def send( self, destination, packet, priority = PRIORITY_NORMAL, callback = None ):
+        with self.condition:
+            if self.queued >= self.maxQueued:
+                self.rejected = self.rejected + 1
+                return False
+            self._push( destination, ( priority, next( self.sequence ),
+                                       [ packet, callback, self.retries ] ) )
+            self.condition.notify()
+        return True
+
+    '''
+    Function    : Transmitter.pending
+    Description : Number of telegrams waiting to be sent
+    Arguments   : none
+    Returns     : number of queued telegrams
+    '''
+    def pending( self ):
+        with self.condition:
+            return self.queued
+
+    def _push( self, destination, entry ):
+        queue = self.queues.setdefault( destination, [] )
+        if not queue or entry < queue[0]:
+            # new head of this destination
+            heapq.heappush( self.heads, ( entry[0], entry[1], destination ) )
+        heapq.heappush( queue, entry )
+        self.queued = self.queued + 1
+
+    def _pop( self ):
+        # skip heads replaced by a more urgent telegram of the same destination
+        while True:
+            priority, seq, destination = heapq.heappop( self.heads )
+            queue = self.queues.get( destination )
+            if queue and queue[0][1] == seq:
+                break
+        entry = heapq.heappop( queue )
+        if queue:
+            heapq.heappush( self.heads, ( queue[0][0], queue[0][1], destination ) )
+        else:
+            del self.queues[destination]
+        self.queued = self.queued - 1
+        return destination, entry
+
+    def run( self ):
+        while True:
+            with self.condition:
+                while self.running and not self.queued:
+                    self.condition.wait()
+                if not self.queued:
+                    return
+                destination, entry = self._pop()
+            packet, callback, retries = entry[2]
+            airtime = airTime( packet )
+            delay = self.dutyCycle.delay( airtime, Clock.monotonic() )
+            if delay > 0 and not self.running:
+                # stopping, do not wait for airtime
+                self.failed = self.failed + 1
+                if callback:
+                    callback( None )
+                continue
+            if delay > 0:
+                # put it back, a more urgent telegram may come meanwhile
+                with self.condition:
+                    self._push( destination, entry )
+                    self.condition.wait( delay )
+                continue
+            self.dutyCycle.use( airtime, Clock.monotonic() )
+            self.airtime = self.airtime + airtime
+            rawResp = EO.sendCommand( self.hSerial, packet, self.timeout )
+            retCode = rawResp[6] if len( rawResp ) > 7 else None
+            if ( retCode is None or retCode in RETRY_CODES ) and retries > 0:
+                entry[2][2] = retries - 1
+                self.retried = self.retried + 1
+                with self.condition:
+                    self.condition.wait( self.backoff )
+                    self._push( destination, entry )
+                continue
+            if retCode == ESP.ESP_returnCodes['RET_OK']:
+                self.sent = self.sent + 1
+            else:
+                self.failed = self.failed + 1
+            if callback:
+                callback( retCode )
+
+    '''
+    Function    : Transmitter.stats
+    Description : Counters of the transmitter
+    Arguments   : none
+    Returns     : hash table with telegrams sent, failed, retried, rejected
+                  when full, still queued and airtime used in seconds
+    '''
+    def stats( self ):
+        with self.condition:
+            return { 'sent'     : self.sent,
+                     'failed'   : self.failed,
+                     'retried'  : self.retried,
+                     'rejected' : self.rejected,
+                     'queued'   : self.queued,
+                     'airtime'  : self.airtime }
+
+    '''
+    Function    : Transmitter.stop
+    Description : Sends what is still queued and ends the thread. Telegrams
+                  waiting for airtime are given up, their callback gets None.
+    Arguments   : none
+    Returns     : none
+    '''
+    def stop( self ):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.join()
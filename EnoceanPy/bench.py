@@ -0,0 +1,296 @@
+#  bench.py -- Benchmarks for the ESP decode path
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+'''
+Usage :
+    python bench.py [ --packets N ] [ --mix RCKR=4,TEMP=3,CNCT=2,RESPONSE=1 ]
+                    [ --noise 0.05 ] [ --chunks 1,16,4096 ] [ --seed 1 ]
+                    [ --output result.json ] [ --compare baseline.json ]
+
+Runs every benchmark over a synthetic ESP3 stream and prints the results as
+JSON. With --compare, each result is also shown against a previous run.
+'''
+
+import argparse
+import json
+import platform
+import random
+import sys
+
+import Clock
+import ESP
+
+'''
+RESPONSE to CO_RD_VERSION, used for RESPONSE packets in the stream
+'''
+VERSION_RESPONSE = [ 0x00, 0x02, 0x07, 0x01, 0x00, 0x02, 0x04, 0x02,
+                     0x01, 0x00, 0x84, 0x23, 0xCC, 0x45, 0x4F, 0x01,
+                     0x03, 0x47, 0x41, 0x54, 0x45, 0x57, 0x41, 0x59,
+                     0x43, 0x54, 0x52, 0x4C, 0x00, 0x00, 0x00, 0x00, 0x00 ]
+
+'''
+Optional data of a received RADIO telegram : subtelegrams, destination ID,
+dBm, security level
+'''
+RADIO_OPT_DATA = [ 0x01, 0xFF, 0xFF, 0xFF, 0xFF, 0x2D, 0x00 ]
+
+DEFAULT_MIX = 'RCKR=4,TEMP=3,CNCT=2,RESPONSE=1'
+
+'''
+Function    : makeFrame
+Description : Builds a complete ESP3 packet
+Arguments   : pktType - packet type
+              data    - data as list of numbers
+              optData - optional data as list of numbers
+Returns     : packet as bytearray
+'''
+def makeFrame( pktType, data, optData ):
+    return bytearray( ESP.encodePacket( pktType, data, optData ) )
+
+def _senderId( rnd ):
+    return [ rnd.randrange( 256 ) for i in range( 4 ) ]
+
+def _rocker( rnd ):
+    return makeFrame( 0x01, [ 0xF6, rnd.choice( [ 0x10, 0x30, 0x50, 0x70, 0x00 ] ) ] +
+                      _senderId( rnd ) + [ 0x30 ], RADIO_OPT_DATA )
+
+def _contact( rnd ):
+    return makeFrame( 0x01, [ 0xD5, rnd.choice( [ 0x08, 0x09 ] ) ] +
+                      _senderId( rnd ) + [ 0x00 ], RADIO_OPT_DATA )
+
+def _temperature( rnd ):
+    return makeFrame( 0x01, [ 0xA5, 0x00, 0x00, rnd.randrange( 256 ), 0x08 ] +
+                      _senderId( rnd ) + [ 0x00 ], RADIO_OPT_DATA )
+
+def _response( rnd ):
+    return makeFrame( 0x02, VERSION_RESPONSE, [] )
+
+_generators = {
+    'RCKR'      : _rocker,
+    'CNCT'      : _contact,
+    'TEMP'      : _temperature,
+    'RESPONSE'  : _response
+}
+
+'''
+Function    : parseMix
+Description : Parses a packet mix given as NAME=weight,...
+Arguments   : text - mix description
+Returns     : list of ( name, weight )
+'''
+def parseMix( text ):
+    mix = []
+    for item in text.split( ',' ):
+        name, weight = item.split( '=' )
+        if name not in _generators:
+            raise ValueError( 'Unknown packet kind %s' %( name ) )
+        mix.append( ( name, float( weight ) ) )
+    return mix
+
+'''
+Function    : generateStream
+Description : Generates a synthetic stream of ESP3 packets
+Arguments   : nPackets - number of packets
+              mix      - list of ( packet kind, weight )
+              noise    - probability of garbage bytes before a packet
+              seed     - random seed, same seed gives the same stream
+Returns     : ( stream as bytearray, list of packets in it as bytearrays )
+'''
+def generateStream( nPackets, mix, noise = 0.0, seed = 1 ):
+    rnd = random.Random( seed )
+    total = sum( weight for name, weight in mix )
+    stream = bytearray()
+    frames = []
+    for i in range( nPackets ):
+        if rnd.random() < noise:
+            # garbage, sometimes with a false SYNC byte
+            stream.extend( rnd.choice( [ 0x55, rnd.randrange( 256 ) ] )
+                           for j in range( rnd.randint( 1, 8 ) ) )
+        pick = rnd.random() * total
+        for name, weight in mix:
+            pick = pick - weight
+            if pick < 0:
+                break
+        frame = _generators[name]( rnd )
+        frames.append( frame )
+        stream.extend( frame )
+    return stream, frames
+
+'''
+Function    : splitChunks
+Description : Cuts a stream into chunks like serial reads would
+Arguments   : stream    - raw data
+              chunkSize - size of each chunk
+Returns     : list of chunks as bytearrays
+'''
+def splitChunks( stream, chunkSize ):
+    return [ stream[pos:pos+chunkSize] for pos in range( 0, len( stream ), chunkSize ) ]
+
+def _percentile( sortedValues, fraction ):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min( len( sortedValues ) - 1, int( len( sortedValues ) * fraction ) )]
+
+'''
+Function    : measure
+Description : Runs func over every item, first all at once for throughput,
+              then one by one for the latency distribution
+Arguments   : func   - function taking one item
+              items  - list of items
+              frames - number of packets covered by items, for per packet rates
+Returns     : hash table of results
+'''
+def measure( func, items, frames = None, repeat = 3 ):
+    if frames is None:
+        frames = len( items )
+    best = None
+    for i in range( repeat ):
+        started = Clock.monotonic()
+        for item in items:
+            func( item )
+        elapsed = Clock.monotonic() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    latencies = []
+    for item in items:
+        started = Clock.monotonic()
+        func( item )
+        latencies.append( Clock.monotonic() - started )
+    latencies.sort()
+    return { 'calls'            : len( items ),
+             'packets'          : frames,
+             'seconds'          : best,
+             'packetsPerSecond' : frames / best if best else 0.0,
+             'usPerPacket'      : best * 1e6 / frames if frames else 0.0,
+             'p50UsPerCall'     : _percentile( latencies, 0.50 ) * 1e6,
+             'p99UsPerCall'     : _percentile( latencies, 0.99 ) * 1e6 }
+
+def _framerRun( chunks ):
+    framer = ESP.Framer()
+    framed = 0
+    for chunk in chunks:
+        framed = framed + len( framer.feed( chunk ) )
+    # end of stream, as after the packet gap on a port
+    while framer.pending():
+        framed = framed + len( framer.resync() )
+    return framed
+
+'''
+Function    : _checkFramed
+Description : Records how many packets a stream decoder found, and warns when
+              it is not the number generated
+Arguments   : result - hash table from measure, framed is added to it
+              name   - benchmark name
+              framed - number of packets found
+              frames - number of packets generated
+Returns     : none
+'''
+def _checkFramed( result, name, framed, frames ):
+    result['framed'] = framed
+    if framed != frames:
+        print >> sys.stderr, "WARNING : %s found %d of %d packets" %( name, framed, frames )
+
+'''
+Function    : runBenchmarks
+Description : Runs all benchmarks
+Arguments   : options - parsed command line
+Returns     : hash table of results by benchmark name
+'''
+def runBenchmarks( options ):
+    mix = parseMix( options.mix )
+    stream, frames = generateStream( options.packets, mix, options.noise, options.seed )
+    packets = [ ESP.decodePacket( frame ) for frame in frames ]
+    radio = [ pkt for pkt in packets if pkt.pktType == 0x01 ]
+    responses = [ pkt for pkt in packets if pkt.pktType == 0x02 ]
+
+    results = {}
+    results['calcCRC8'] = measure( lambda frame: ESP.calcCRC8( frame[6:-1] ), frames )
+    results['decodePacket'] = measure( ESP.decodePacket, frames )
+    results['decodeRawResponse'] = measure( ESP.decodeRawResponse, [ stream ],
+                                            len( frames ), 1 )
+    _checkFramed( results['decodeRawResponse'], 'decodeRawResponse',
+                  len( ESP.decodeRawResponse( stream ) ), len( frames ) )
+    for chunkSize in options.chunks:
+        chunks = splitChunks( stream, chunkSize )
+        name = 'framer.chunk%d' %( chunkSize )
+        results[name] = measure( _framerRun, [ chunks ], len( frames ), 1 )
+        _checkFramed( results[name], name, _framerRun( chunks ), len( frames ) )
+    if radio:
+        results['decodeRadioData'] = measure( ESP.decodeRadioData, radio )
+    if responses:
+        results['decodeResponseData'] = measure(
+            lambda pkt: ESP.decodeResponseData( pkt, 'CO_RD_VERSION' ), responses )
+    return results
+
+'''
+Function    : compare
+Description : Prints results next to those of an earlier run
+Arguments   : results  - results of this run
+              baseline - results loaded from an earlier run
+Returns     : none
+'''
+def compare( results, baseline ):
+    print >> sys.stderr, "%-24s %14s %14s %8s" %( 'benchmark', 'baseline/s', 'now/s', 'change' )
+    for name in sorted( results ):
+        now = results[name]['packetsPerSecond']
+        if name not in baseline:
+            print >> sys.stderr, "%-24s %14s %14.0f %8s" %( name, '-', now, 'new' )
+            continue
+        before = baseline[name]['packetsPerSecond']
+        change = ( now - before ) * 100.0 / before if before else 0.0
+        print >> sys.stderr, "%-24s %14.0f %14.0f %+7.1f%%" %( name, before, now, change )
+
+'''
+Function    : main
+Description : main function
+Arguments   : see Usage
+Returns     : none
+'''
+def main():
+    parser = argparse.ArgumentParser( description = 'ESP decode path benchmarks' )
+    parser.add_argument( '--packets', type = int, default = 20000 )
+    parser.add_argument( '--mix', default = DEFAULT_MIX )
+    parser.add_argument( '--noise', type = float, default = 0.0 )
+    parser.add_argument( '--chunks', default = '1,16,4096' )
+    parser.add_argument( '--seed', type = int, default = 1 )
+    parser.add_argument( '--output' )
+    parser.add_argument( '--compare' )
+    options = parser.parse_args()
+    options.chunks = [ int( size ) for size in options.chunks.split( ',' ) ]
+
+    report = {
+        'python'    : platform.python_version(),
+        'machine'   : platform.machine(),
+        'options'   : { 'packets' : options.packets, 'mix' : options.mix,
+                        'noise' : options.noise, 'chunks' : options.chunks,
+                        'seed' : options.seed },
+        'results'   : runBenchmarks( options )
+    }
+    text = json.dumps( report, indent = 2, sort_keys = True )
+    if options.output:
+        with open( options.output, 'w' ) as output:
+            output.write( text + '\n' )
+    else:
+        print text
+    if options.compare:
+        with open( options.compare ) as baseline:
+            compare( report['results'], json.load( baseline )['results'] )
+
+if __name__ == "__main__":
+    main()
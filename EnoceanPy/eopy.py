@@ -40,9 +40,9 @@ def main():
     print "\tUsing serial port : " + ttyPort + '\n'
 
     # CO_RD_VERSION command
-    cmd0 = [ 0x55, 0x00, 0x01, 0x00, 0x05, 0x70, 0x03, 0x09 ]
+    cmd0 = ESP.encodeCommand( 'CO_RD_VERSION' )
     # CO_RD_IDBASE command
-    cmd1 = [ 0x55, 0x00, 0x01, 0x00, 0x05, 0x70, 0x08, 0x38 ]
+    cmd1 = ESP.encodeCommand( 'CO_RD_IDBASE' )
 
     hEOGateway = EO.connect( ttyPort )
     # better to wait a little for connection to establish
@@ -66,8 +66,8 @@ def main():
         print"\t[NONE]"
     ## Send CO_RD_VERSION
     print "RQST       : ",
-    for i in range( len( cmd0 ) ):
-        print "%02X" %( cmd0[i] ),
+    for byte in bytearray( cmd0 ):
+        print "%02X" %( byte ),
     print ''
     rawResp = EO.sendData( hEOGateway, cmd0 )
     print 'RESP(%3dB) : ' %len( rawResp ),
@@ -79,8 +79,8 @@ def main():
 
     ## Send CO_RD_IDBASE
     print "RQST       : ",
-    for i in range( len( cmd1 ) ):
-        print "%02X" %( cmd1[i] ),
+    for byte in bytearray( cmd1 ):
+        print "%02X" %( byte ),
     print ''
     #~ EO_receiveData( hEOGateway )        # Read any buffered data
     rawResp = EO.sendData( hEOGateway, cmd1 )
@@ -91,17 +91,20 @@ def main():
     pkt = ESP.decodePacket( rawResp )
     ESP.displayPacketInfo( pkt, 'CO_RD_IDBASE' )
 
+    framer = ESP.Framer()
     try:
         while( True ):
-            rawResp = EO.receiveData( hEOGateway )
-            if rawResp:
+            # sleeps in select() until packets are complete
+            frames = EO.receivePackets( hEOGateway, framer )
+            if frames:
                 print strftime("%Y-%m-%d %H:%M:%S",gmtime()),": ",
                 print '[RXD] ',
-                for i in range( len( rawResp ) ):
-                    print "%02X" %(rawResp[i]),
+                for frame in frames:
+                    for i in range( len( frame ) ):
+                        print "%02X" %(frame[i]),
                 print ''
-                pkts = ESP.decodeRawResponse( rawResp )
-                for pkt in pkts:
+                for frame in frames:
+                    pkt = ESP.decodePacket( frame )
                     print "    :> ",
                     for i in range(len(pkt['data_recv'])):
                         print "%02X" %(pkt['data_recv'][i]),
@@ -0,0 +1,58 @@
+#  A5_02.py -- EEP A5-02 : Temperature sensors
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+DEV = 'TEMP'
+
+'''
+Temperature range ( min, max ) in degree Celsius, by TYPE. The raw value runs
+from max ( 0 ) down to min ( 255, or 1023 for the 10 bit types ).
+'''
+_ranges = {}
+for _type in range( 0x01, 0x0C ):
+    _ranges[_type] = ( -40.0 + 10*( _type - 0x01 ), 0.0 + 10*( _type - 0x01 ) )
+for _type in range( 0x10, 0x1C ):
+    _ranges[_type] = ( -60.0 + 10*( _type - 0x10 ), 20.0 + 10*( _type - 0x10 ) )
+_ranges[0x20] = ( -10.0, 41.2 )
+_ranges[0x30] = ( -40.0, 62.3 )
+
+'''
+Function    : getDecoder
+Description : Gives the decoder for a TYPE of this profile
+Arguments   : type - EEP TYPE
+Returns     : decode( raw, offset, length ) function
+'''
+def getDecoder( type ):
+    if type not in _ranges:
+        raise KeyError( 'EEP A5-02-%02X not supported' %( type ) )
+    low, high = _ranges[type]
+    # data bytes are DB3 DB2 DB1 DB0 after RORG; DB0 bit 3 is LRN ( 0 - teach-in )
+    if type in ( 0x20, 0x30 ):
+        scale = ( high - low ) / 1023
+        def decodeTemperature( raw, offset, length ):
+            if not raw[offset+4] & 0x08:
+                return { 'learn' : True }
+            value = ( raw[offset+2] & 0x03 ) * 256 + raw[offset+3]
+            return { 'temp' : round( high - value*scale, 2 ) }
+    else:
+        scale = ( high - low ) / 255
+        def decodeTemperature( raw, offset, length ):
+            if not raw[offset+4] & 0x08:
+                return { 'learn' : True }
+            return { 'temp' : round( high - raw[offset+3]*scale, 2 ) }
+    return decodeTemperature
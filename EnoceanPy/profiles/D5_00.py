@@ -0,0 +1,41 @@
+#  D5_00.py -- EEP D5-00 : Contacts and switches
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+DEV = 'CNCT'
+
+'''
+DB0 of a D5-00-01 telegram : bit 3 LRN ( 0 - teach-in ), bit 0 contact
+( 0 - open, 1 - closed )
+'''
+def _decodeContact( raw, offset, length ):
+    db0 = raw[offset+1]
+    if not db0 & 0x08:
+        return { 'learn' : True }
+    return { 'status' : db0 & 0x01 }
+
+'''
+Function    : getDecoder
+Description : Gives the decoder for a TYPE of this profile
+Arguments   : type - EEP TYPE
+Returns     : decode( raw, offset, length ) function
+'''
+def getDecoder( type ):
+    if type != 0x01:
+        raise KeyError( 'EEP D5-00-%02X not supported' %( type ) )
+    return _decodeContact
@@ -0,0 +1,54 @@
+#  F6_02.py -- EEP F6-02 : Rocker switch, 2 rocker
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+DEV = 'RCKR'
+
+'''
+Rocker actions, by the 3 bit rocker action code
+'''
+_actions = [ 'AI', 'A0', 'BI', 'B0', 'CI', 'C0', 'DI', 'D0' ]
+
+'''
+DB0 of a F6-02-01/02 telegram:
+   7  6  5     4     3  2  1     0
++---------+---------+---------+----+
+|   R1    |   EB    |   R2    | SA |
++---------+---------+---------+----+
+R1 - first action, EB - energy bow pressed, R2 - second action,
+SA - second action valid
+'''
+def _decodeRocker( raw, offset, length ):
+    db0 = raw[offset+1]
+    if not db0 & 0x10:
+        return { 'action' : 'released' }
+    values = { 'action' : _actions[db0 >> 5] }
+    if db0 & 0x01:
+        values['action2'] = _actions[( db0 >> 1 ) & 0x07]
+    return values
+
+'''
+Function    : getDecoder
+Description : Gives the decoder for a TYPE of this profile
+Arguments   : type - EEP TYPE
+Returns     : decode( raw, offset, length ) function
+'''
+def getDecoder( type ):
+    if type not in ( 0x01, 0x02 ):
+        raise KeyError( 'EEP F6-02-%02X not supported' %( type ) )
+    return _decodeRocker
@@ -0,0 +1 @@
+#  profiles -- EnOcean Equipment Profile decoders, loaded on demand by EEP.py
@@ -20,8 +20,16 @@
 #  
 
 
+import json
+import os
+import tempfile
+import StringIO
+
 import EO
 import ESP
+import Capture
+import Bulk
+import bench
 
 '''
 Function    :
@@ -79,6 +87,43 @@ def main():
     pkt = ESP.decodePacket( testData )
     ESP.displayPacketInfo( pkt, 'CO_RD_IDBASE' )
     
+    # Responses with variable length fields
+    testData = [ 0x55,
+                 0x00, 0x07, 0x00, 0x02,
+                 0x18,
+                 0x00, 0x0A, 0x00, 0x03, 0x1F, 0x00, 0x00,
+                 0xC2 ]
+    print "RAW DATA   : ",
+    for i in range( len( testData ) ):
+        print "%02X" %( testData[i] ),
+    print ''
+    pkt = ESP.decodePacket( testData )
+    ESP.displayPacketInfo( pkt, 'C0_RD_SYS_LOG' )
+    
+    testData = [ 0x55,
+                 0x00, 0x0B, 0x00, 0x02,
+                 0xE2,
+                 0x00, 0x00, 0x00, 0x15, 0xE4, 0x3A, 0x00, 0x00, 0x82, 0xA3, 0x45,
+                 0xED ]
+    print "RAW DATA   : ",
+    for i in range( len( testData ) ):
+        print "%02X" %( testData[i] ),
+    print ''
+    pkt = ESP.decodePacket( testData )
+    ESP.displayPacketInfo( pkt, 'CO_RD_FILTER' )
+    
+    testData = [ 0x55,
+                 0x00, 0x06, 0x00, 0x02,
+                 0x73,
+                 0x00, 0xDE, 0xAD, 0xBE, 0xEF, 0x01,
+                 0x7F ]
+    print "RAW DATA   : ",
+    for i in range( len( testData ) ):
+        print "%02X" %( testData[i] ),
+    print ''
+    pkt = ESP.decodePacket( testData )
+    ESP.displayPacketInfo( pkt, 'CO_RD_MEM' )
+    
     # Test data 4 : Response from Rocker Switch
     testData = [ 0x55,
                  0x00, 0x07, 0x07, 0x01,
@@ -118,5 +163,56 @@ def main():
     for packet in packets:
         print "[PACKET]................................................................."
         ESP.displayPacketInfo( packet, 'CO_RD_VERSION' )
+
+    # decode packets split across reads, with some noise in between
+    chunks = [ [ 0x00, 0x55, 0x13 ] + testData[:4],
+               testData[4:20],
+               testData[20:21],
+               testData[21:] ]
+    framer = ESP.Framer()
+    print "Test for decoding packets split across reads : "
+    for chunk in chunks:
+        for frame in framer.feed( chunk ):
+            print "[PACKET]................................................................."
+            ESP.displayPacketInfo( ESP.decodePacket( frame ), 'CO_RD_VERSION' )
+    print "Pending bytes : %d" %( framer.pending() )
+
+    # a valid CRC8H announcing more than maxLength bytes is a false SYNC byte,
+    # the packets behind it are found at once instead of after 4 KB
+    falseHeader = bytearray( [ 0x55, 0x10, 0x00, 0x00, 0x01 ] )
+    falseHeader.append( ESP.calcCRC8Header( falseHeader ) )
+    print "Test for a header longer than maxLength : "
+    for maxLength in ( ESP.MAX_DATA_LENGTH, 0xFFFF ):
+        framer = ESP.Framer( maxLength = maxLength )
+        frames = framer.feed( falseHeader + bytearray( testData ) )
+        print "maxLength %d : %d packets, %d false syncs, %d bytes pending" %( maxLength, len( frames ),
+                                                                              framer.falseSyncs,
+                                                                              framer.pending() )
+
+    # decode a noisy capture in segments and compare with a serial replay;
+    # false headers announcing 128 bytes often hang over a segment end
+    stream, frames = bench.generateStream( 2000, bench.parseMix( bench.DEFAULT_MIX ), 0.05, 1 )
+    falseHeader = bytearray( [ 0x55, 0x00, 0x80, 0x00, 0x01 ] )
+    falseHeader.append( ESP.calcCRC8Header( falseHeader ) )
+    noisy = bytearray()
+    for i in range( len( frames ) ):
+        if i % 20 == 0:
+            noisy.extend( falseHeader )
+        noisy.extend( frames[i] )
+    path = tempfile.mktemp( '.eocp' )
+    writer = Capture.CaptureWriter( path )
+    for chunk in bench.splitChunks( noisy, 64 ):
+        writer.write( chunk )
+    writer.close()
+    replay = Capture.Replay( path )
+    serial = [ pkt.data.tobytes().encode( 'hex' ) for pkt in replay.packets() ]
+    replay.close()
+    output = StringIO.StringIO()
+    nPackets, nErrors = Bulk.decodeCapture( path, output, 1, 1024 )
+    bulk = [ json.loads( line )['data'] for line in output.getvalue().splitlines() ]
+    os.remove( path )
+    print "Test for decoding a noisy capture in segments : "
+    print "Serial replay : %d packets, segments : %d packets, same : %s" %( len( serial ), nPackets,
+                                                                           bulk == serial )
 if __name__ == "__main__":
     main()
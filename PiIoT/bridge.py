@@ -10,13 +10,57 @@ if libPath not in sys.path:
 
 from EnoceanPy import EO
 from EnoceanPy import ESP
+from EnoceanPy import Dedup
+from EnoceanPy import State
+from EnoceanPy import Metrics
+from EnoceanPy import Clock
+from EnoceanPy import Trace
+from EnoceanPy import Filters
+from EnoceanPy import Rules
+from EnoceanPy import Transmit
 
 import paho.mqtt.client as mqtt
 import paho.mqtt.publish as publish
 
+from publisher import Publisher
+
 basePath    = 'usr/vish/'
 appPath     = 'sensors/'
 
+# Publish a device only when a value changed by more than its deadband,
+# or at least every maxSilence seconds
+deadbands   = { 'temp' : 0.2 }
+maxSilence  = 900
+
+# MQTT QoS by device class, others use 0
+qosByDev    = { 'RCKR' : 1, 'CNCT' : 1 }
+
+# Sender IDs the gateway passes on, others are filtered out by the gateway
+# itself; empty to receive all telegrams
+allowedDevices = []
+
+# Metrics in Prometheus text format on http://127.0.0.1:metricsPort/metrics,
+# None to disable
+metricsPort = 9108
+
+# Latency of every published telegram is counted per device class; one trace
+# out of traceEvery is written to traceLog, None to disable
+traceLog    = None
+traceEvery  = 100
+
+# Local automation, run before publishing so that eg. a rocker switches a
+# light without a round trip through the broker. Actions are 'transmit' with
+# ( destination, rorg, payload ) and 'publish' with ( topic, payload ), see
+# EnoceanPy/Rules.py
+localRules  = [
+    # ( sender ID, value name, value, action, arguments )
+    # ( 0x0015E43A, 'action', 'AI', 'transmit', ( 0x0082A345, 0xF6, [ 0x30 ] ) ),
+    # ( 0x0015E43A, 'action', 'B0', 'publish', ( 'scenes/living', 'evening' ) ),
+]
+
+stageTime   = Metrics.histogram( 'bridge_stage_seconds', 'Processing time per stage',
+                                 labels = ( 'stage', ) )
+
 ## Define MQTT callbacks
 def onConnect( client, userData, retCode ):
     client.publish( basePath+'devices/enocean', '{"name":"enocean gateway","desc":"ESP to MQTT bridge"}' );
@@ -29,7 +73,7 @@ def main():
     print "\tEncoean gateway port : " + ttyPort + '\n'
 
     # CO_RD_IDBASE command
-    cmd1 = [ 0x55, 0x00, 0x01, 0x00, 0x05, 0x70, 0x08, 0x38 ]
+    cmd1 = ESP.encodeCommand( 'CO_RD_IDBASE' )
 
     hEOGateway = EO.connect( ttyPort )
     # better to wait a little for connection to establish
@@ -41,8 +85,8 @@ def main():
    
     ## Send CO_RD_IDBASE
     print "RQST       : ",
-    for i in range( len( cmd1 ) ):
-        print "%02X" %( cmd1[i] ),
+    for byte in bytearray( cmd1 ):
+        print "%02X" %( byte ),
     print ''
     #~ EO_receiveData( hEOGateway )        # Read any buffered data
     rawResp = EO.sendData( hEOGateway, cmd1 )
@@ -53,67 +97,127 @@ def main():
     pkt = ESP.decodePacket( rawResp )
     ESP.displayPacketInfo( pkt, 'CO_RD_IDBASE' )
 
+    # push the allowlist to the gateway filter table
+    filters = Filters.FilterManager( hEOGateway, allowedDevices )
+    if not filters.sync():
+        print "ERROR : Gateway filters not set, receiving all telegrams"
+
     # Connect to broker
     client = mqtt.Client( client_id = "enocean_bridge",
                             clean_session = True );
     client.on_connect = onConnect;
     client.connect( "192.168.1.54", 1883, 60 )
     client.loop_start();
+    # publishing runs in its own thread, reading never waits for the broker
+    tracer = Trace.Tracer( traceEvery, open( traceLog, 'a' ) if traceLog else None )
+    publisher = Publisher( client, qos = qosByDev, tracer = tracer )
+    publisher.start()
+
+    # telegrams of other senders are dropped before decoding, also when the
+    # gateway filter table could not be set
+    framer = ESP.Framer( allowedDevices or None )
+
+    rules = Rules.RuleEngine()
+    if localRules:
+        # the transmitter reads RESPONSEs while the loop below reads
+        # telegrams; the reader thread then frames with the allowlist
+        EO.startReader( hEOGateway, framer = framer )
+        transmitter = Transmit.Transmitter( hEOGateway )
+        transmitter.start()
+        rules.addAction( 'transmit', Rules.transmitAction( transmitter ) )
+        rules.addAction( 'publish', Rules.publishAction( publisher, basePath ) )
+        print "Local rules : %d" %( rules.load( localRules ) )
+
+    # same telegram may be received again through repeaters
+    dedup = Dedup.DedupCache()
+    states = State.StateCache( deadbands, maxSilence )
 
+    Metrics.counter( 'bridge_duplicates_total', 'Repeated telegrams suppressed',
+                     func = lambda: dedup.suppressed )
+    Metrics.gauge( 'bridge_publish_queue_depth', 'Messages waiting to be published',
+                   func = publisher.depth )
+    Metrics.counter( 'bridge_published_total', 'Messages published',
+                     func = lambda: publisher.published )
+    Metrics.counter( 'bridge_publish_dropped_total', 'Messages dropped on full publish queue',
+                     func = lambda: publisher.dropped )
+    Metrics.counter( 'bridge_publish_coalesced_total', 'Messages replaced by a newer one before publishing',
+                     func = lambda: publisher.coalesced )
+    frameTime = stageTime.labels( 'frame' )
+    packetTime = stageTime.labels( 'packet' )
+    radioTime = stageTime.labels( 'radio' )
+    publishTime = stageTime.labels( 'publish' )
+    if metricsPort:
+        metricsServer = Metrics.serve( metricsPort )
     try:
         while( True ):
-            rawResp = EO.receiveData( hEOGateway )
-            if rawResp:
+            # sleeps in select() until packets are complete; times holds for
+            # each packet the read it started in and the read completing it
+            times = []
+            frames = EO.receivePackets( hEOGateway, framer, times = times )
+            if frames:
                 print strftime("%Y-%m-%d %H:%M:%S",gmtime()),": ",
                 print '[RXD] ',
-                for i in range( len( rawResp ) ):
-                    print "%02X" %(rawResp[i]),
+                for frame in frames:
+                    for i in range( len( frame ) ):
+                        print "%02X" %(frame[i]),
                 print ''
-                pkts = ESP.decodeRawResponse( rawResp )
-                for pkt in pkts:
+                done = Clock.monotonic()
+                for frame, ( readAt, framedAt ) in zip( frames, times ):
+                    # waiting for the rest of the packet on the UART
+                    frameTime.observe( framedAt - readAt )
+                    if dedup.isDuplicate( frame ):
+                        continue
+                    started = done
+                    pkt = ESP.decodePacket( frame )
+                    done = Clock.monotonic()
+                    packetTime.observe( done - started )
                     # print "    :> ",
                     # for i in range(len(pkt['data_recv'])):
                     #     print "%02X" %(pkt['data_recv'][i]),
                     # print ''
                 #     print "[PACKET]................................................................."
+                    if pkt.pktType != ESP.ESP_packetTypes['RADIO'] or not pkt.crc8dOk:
+                        continue
+                    started = done
                     telegram = ESP.decodeRadioData( pkt )
-                    if( telegram['dev'] != 'UNKN' ):    # Not an unknown telelgram
+                    done = Clock.monotonic()
+                    radioTime.observe( done - started )
+                    decodedAt = done
+                    if( telegram['dev'] != 'UKWN' ):    # Not an unknown telelgram
+                        # local reactions first, also when the state did not change
+                        rules.run( telegram )
+                        if not states.update( telegram['sender'], telegram['dev'], telegram['values'] ):
+                            continue                    # nothing new to tell
                         mqttPacket = {}
-                        str_id = ""
-                        for i in telegram['id']:
-                            str_id = str_id + ("%02X" %i)
+                        str_id = "%08X" %( telegram['sender'] )
                         mqttPacket['id'] = str_id;
-                        # Check which sensor send the telegram
-                        if telegram['dev'] == 'RCKR':
-                            # From rocker swicth
-                            action  = telegram['data'] & 0xE0
-                            bow     = telegram['data'] & 0x10
-                            if bow == 0x10:
-                                if action == 0x00:
-                                    mqttPacket['action'] = 'AI'
-                                elif action == 0x01:
-                                    mqttPacket['action'] = 'A0'
-                                elif action == 0x20:
-                                    mqttPacket['action'] = 'BI'
-                                elif action == 0x30:
-                                    mqttPacket['action'] = 'B0'
-                                else:
-                                    print "%02X" %action
-                                    mqttPacket['action'] = 'invalid'
-                            else:
-                                mqttPacket['action'] = 'released'
-                        elif telegram['dev'] == 'TEMP':     # From temperature sensor
-                            # 3rd byte in data is useful
-                            mqttPacket['temp'] = 20.0 + (60.0-20.0)/255*telegram['data'][2]
-                        elif telegram['dev'] == 'CNCT':
-                            mqttPacket['status'] = telegram['data']&0x01;
+                        # values decoded by the EEP profile of the sensor,
+                        # eg. action for rocker switch, temp for temperature sensor
+                        mqttPacket.update( telegram['values'] )
 
                         str_mqtt = ', '.join("%s=%r" % (key,val) for (key,val) in mqttPacket.iteritems())
                         print( str_mqtt )
-                        client.publish( basePath+appPath+str_id, str_mqtt );
+                        trace = tracer.start( telegram['dev'], telegram['sender'], readAt, framedAt )
+                        trace.decoded = decodedAt
+                        trace.queued = Clock.monotonic()
+                        publisher.publish( basePath+appPath+str_id, str_mqtt, telegram['dev'], trace )
+                        done = Clock.monotonic()
+                        publishTime.observe( done - decodedAt )
                 # print "........................................................................."
     except KeyboardInterrupt:
         print "\nExiting Enocean MQTT Brdige"
+        print "Duplicate telegrams suppressed : %d" %( dedup.suppressed )
+        print "Telegrams of other senders dropped : %d" %( framer.rejected )
+        if localRules:
+            transmitter.stop()
+            print "Rule actions run : %d, failed %d, telegrams sent %d" %( rules.fired, rules.errors,
+                                                                          transmitter.sent )
         EO.disconnect( hEOGateway )
+        if metricsPort:
+            metricsServer.shutdown()
+        publisher.stop()
+        for dev, latency in sorted( tracer.summary().items() ):
+            print "Latency %-4s : %d telegrams, mean %.1f ms, max %.1f ms" %( dev, latency['count'],
+                                                                           latency['mean'] * 1000, latency['max'] * 1000 )
         client.disconnect()
 main()
\ No newline at end of file
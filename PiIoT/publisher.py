@@ -0,0 +1,108 @@
+# publisher.py -- MQTT publishing off the serial read path
+import threading
+import itertools
+from collections import OrderedDict
+
+'''
+Class       : Publisher
+Description : Thread publishing MQTT messages queued by the bridge, so that
+              reading the gateway never waits for the broker. Updates queued
+              for the same topic before they went out are coalesced into the
+              latest one, except for event device classes ( eg. rocker
+              switches ) where every message counts. All messages pending
+              when the thread wakes up are handed to the client together.
+              With a tracer ( see EnoceanPy/Trace.py ), the trace of each
+              message is finished once the client has it.
+'''
+class Publisher( threading.Thread ):
+
+    def __init__( self, client, maxPending = 256, qos = None, defaultQos = 0,
+                  events = ( 'RCKR', ), tracer = None ):
+        threading.Thread.__init__( self, name = 'MQTT publisher' )
+        self.daemon = True
+        self.client = client
+        self.maxPending = maxPending
+        self.qos = qos or {}            # device class -> QoS
+        self.defaultQos = defaultQos
+        self.events = set( events )     # device classes never coalesced
+        self.tracer = tracer
+        self.pending = OrderedDict()    # key -> ( topic, payload, qos, trace )
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.published = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.batches = 0
+
+    '''
+    Function    : Publisher.publish
+    Description : Queues a message without waiting. When the queue is full
+                  the message is dropped and counted.
+    Arguments   : topic   - MQTT topic
+                  payload - message
+                  dev     - device class, selects QoS and coalescing
+                  trace   - Trace.TelegramTrace of the message, if any. A
+                            coalesced message keeps the trace of the one it
+                            replaces.
+    Returns     : True if queued, False if dropped
+    '''
+    def publish( self, topic, payload, dev = None, trace = None ):
+        qos = self.qos.get( dev, self.defaultQos )
+        if dev in self.events:
+            key = ( topic, next( self.sequence ) )
+        else:
+            key = topic
+        with self.condition:
+            if key in self.pending:
+                self.coalesced = self.coalesced + 1
+                # keep the trace of the oldest telegram still waiting, so the
+                # latency published covers the whole time it was superseded
+                older = self.pending[key][3]
+                if older is not None:
+                    trace = older
+            elif len( self.pending ) >= self.maxPending:
+                self.dropped = self.dropped + 1
+                return False
+            self.pending[key] = ( topic, payload, qos, trace )
+            self.condition.notify()
+        return True
+
+    def run( self ):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                batch = self.pending
+                self.pending = OrderedDict()
+            tracer = self.tracer
+            for topic, payload, qos, trace in batch.itervalues():
+                self.client.publish( topic, payload, qos )
+                if trace and tracer:
+                    tracer.finish( trace )
+            self.published = self.published + len( batch )
+            self.batches = self.batches + 1
+
+    '''
+    Function    : Publisher.depth
+    Description : Number of messages waiting to be published
+    Arguments   : none
+    Returns     : queue depth
+    '''
+    def depth( self ):
+        with self.condition:
+            return len( self.pending )
+
+    '''
+    Function    : Publisher.stop
+    Description : Publishes what is still queued and ends the thread
+    Arguments   : none
+    Returns     : none
+    '''
+    def stop( self ):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.join()